@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from pathlib import Path
+from anyio import create_task_group
+from client import drain_queue
+from dedup import ReplayFilter, prime_from_history
+from history import HistoryIndex, HistoryReader, save_messages
+from liveness import LivenessMonitor
+from logs import add_logging_arguments, setup_logging
+from queues import create_queue
+from server import read_msgs
+from utils import ReconnectPolicy, get_parser, reconnect
+
+logger = logging.getLogger('archiver')
+reader_logger = logging.getLogger('archiver.reader')
+
+
+def parse_arguments():
+    """Обработка аргументов командной строки."""
+    parser = get_parser(
+        'Headless archiver of many chats sharded across processes.',
+        'config.conf',
+    )
+    parser.add_arg(
+        '--targets',
+        nargs='*',
+        default=[],
+        help='Chats to archive as HOST:READ_PORT[=HISTORY_FILE]',
+    )
+    parser.add_arg(
+        '--targets_file',
+        help='File with one HOST:READ_PORT[=HISTORY_FILE] per line',
+    )
+    parser.add_arg(
+        '--archive_dir',
+        default='archive',
+        help='Directory for history files of targets without explicit file',
+    )
+    parser.add_arg(
+        '--processes',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Number of worker processes',
+    )
+    parser.add_arg(
+        '--report_interval',
+        type=float,
+        default=5,
+        help='Seconds between throughput reports',
+    )
+    add_logging_arguments(parser, 'INFO')
+    config, _ = parser.parse_known_args()
+    return config
+
+
+def parse_target(target: str, archive_dir: str):
+    """«HOST:PORT[=FILE]» -> (host, port, файл истории)."""
+    address, _, history = target.strip().partition('=')
+    host, _, port = address.rpartition(':')
+    if not history:
+        history = str(Path(archive_dir) / f'{host}_{port}.history')
+    return host, int(port), history
+
+
+def load_targets(args):
+    targets = list(args.targets)
+    if args.targets_file:
+        with open(args.targets_file) as targets_file:
+            targets.extend(
+                line for line in targets_file
+                if line.strip() and not line.startswith('#')
+            )
+    return [parse_target(target, args.archive_dir) for target in targets]
+
+
+async def count_messages(messages_queue, counters, target):
+    """Подсчёт принятых сообщений вместо вывода в интерфейс."""
+    while True:
+        counters[target] += len(await messages_queue.get())
+
+
+async def archive_target(host: str, port: int, history: str, counters):
+    """Чтение одного чата и запись его истории."""
+    target = f'{host}:{port}'
+    messages_queue = create_queue('messages')
+    messages_history_queue = create_queue('history')
+    status_queue = create_queue('status')
+    Path(history).parent.mkdir(parents=True, exist_ok=True)
+    history_index = HistoryIndex(history)
+    await history_index.load()
+    replay_filter = ReplayFilter()
+    prime_from_history(
+        replay_filter,
+        HistoryReader(history, history_index),
+        1000,
+    )
+    async with create_task_group() as tg:
+        tg.start_soon(
+            reconnect(policy=ReconnectPolicy())(read_msgs),
+            messages_queue,
+            messages_history_queue,
+            status_queue,
+            LivenessMonitor(),
+            host,
+            port,
+            reader_logger,
+            replay_filter,
+        )
+        tg.start_soon(
+            save_messages,
+            history,
+            messages_history_queue,
+            64 * 1024,
+            1.0,
+            0,
+            history_index,
+        )
+        tg.start_soon(count_messages, messages_queue, counters, target)
+        tg.start_soon(drain_queue, status_queue)
+
+
+async def report_counters(shard: int, counters, stats_queue, interval):
+    while True:
+        await asyncio.sleep(interval)
+        stats_queue.put((shard, dict(counters)))
+
+
+async def run_shard(shard: int, targets, stats_queue, interval: float):
+    """Один цикл событий на процесс для всех чатов шарда."""
+    counters = {f'{host}:{port}': 0 for host, port, _ in targets}
+    async with create_task_group() as tg:
+        for host, port, history in targets:
+            tg.start_soon(archive_target, host, port, history, counters)
+        tg.start_soon(report_counters, shard, counters, stats_queue, interval)
+
+
+def shard_worker(shard: int, targets, stats_queue, args):
+    setup_logging(args)
+    try:
+        asyncio.run(
+            run_shard(shard, targets, stats_queue, args.report_interval),
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+def report_throughput(stats_queue, workers, interval: float):
+    """Сводная скорость архивации по всем процессам."""
+    shard_counters = {}
+    previous_total = 0
+    previous_time = time.monotonic()
+    while any(worker.is_alive() for worker in workers):
+        try:
+            shard, counters = stats_queue.get(timeout=interval)
+            shard_counters[shard] = counters
+        except queue.Empty:
+            pass
+
+        now = time.monotonic()
+        if now - previous_time < interval:
+            continue
+        total = sum(
+            sum(counters.values()) for counters in shard_counters.values()
+        )
+        logger.info(
+            f'Archived {total} messages from '
+            f'{sum(map(len, shard_counters.values()))} chats, '
+            f'{(total - previous_total) / (now - previous_time):.1f} msg/s',
+        )
+        previous_total, previous_time = total, now
+
+
+def main():
+    args = parse_arguments()
+    setup_logging(args)
+    targets = load_targets(args)
+    if not targets:
+        logger.error('Не заданы чаты для архивации (--targets).')
+        return
+
+    processes = max(1, min(args.processes, len(targets)))
+    stats_queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=shard_worker,
+            args=(
+                shard,
+                targets[shard::processes],
+                stats_queue,
+                args,
+            ),
+        )
+        for shard in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        report_throughput(stats_queue, workers, args.report_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.join()
+
+
+if __name__ == '__main__':
+    main()
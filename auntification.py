@@ -1,10 +1,15 @@
+import asyncio
+import json
+import os
+import time
 import aiofiles
+from async_timeout import timeout as async_timeout
 from utils import (
     open_connection,
     close_connection,
     convert_json_string_to_object,
     write_to_socket,
-    read_and_print_from_socket,
+    LineFramer,
 )
 
 
@@ -29,25 +34,195 @@ class InvalidToken(Exception):
     pass
 
 
-async def authorize(reader, writer, logger, token_file, token=None):
-    await read_and_print_from_socket(reader, logger)
+class TokenCache:
+    """
+        Токены, прочитанные из файлов. Файл перечитывается, только если
+        изменились его время модификации или размер.
+    """
+
+    def __init__(self):
+        self._tokens = {}
+
+    async def get(self, token_file: str) -> str:
+        file_stat = os.stat(token_file)
+        version = (file_stat.st_mtime_ns, file_stat.st_size)
+        cached = self._tokens.get(token_file)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        async with aiofiles.open(token_file, mode='r') as token_file_obj:
+            token = (await token_file_obj.read()).rstrip()
+        self._tokens[token_file] = (version, token)
+        return token
+
+    def invalidate(self, token_file: str):
+        self._tokens.pop(token_file, None)
+
+
+class TokenStore:
+    """
+        Токены многих пользователей в одном файле: по строке JSON
+        {"name", "nickname", "token"} на запись, ключ - имя, под которым
+        регистрировался пользователь. Новые записи дописываются в конец,
+        при чтении последняя запись имени заменяет предыдущие.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tokens = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return self
+        with open(self.path, encoding='utf-8') as store_file:
+            for line in store_file:
+                entry = convert_json_string_to_object(line)
+                if entry:
+                    self.tokens[entry['name']] = entry
+        return self
+
+    def __contains__(self, name: str):
+        return name in self.tokens
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def get(self, name: str):
+        entry = self.tokens.get(name)
+        return entry['token'] if entry else None
+
+    async def add(self, entries):
+        """Запись пачки {"name", "nickname", "token"} в файл."""
+        if not entries:
+            return
+        text = ''.join(
+            json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries
+        )
+        async with aiofiles.open(self.path, mode='a', encoding='utf-8') as (
+            store_file
+        ):
+            await store_file.write(text)
+            await store_file.flush()
+        for entry in entries:
+            self.tokens[entry['name']] = entry
+
+
+class AuthMetrics:
+    """Длительность этапов авторизации: последняя и средняя, секунды."""
+
+    PHASES = ('token', 'greeting', 'response', 'welcome', 'total')
+
+    def __init__(self):
+        self.count = 0
+        self.pipelined = 0
+        self.last = dict.fromkeys(self.PHASES, 0.0)
+        self.total = dict.fromkeys(self.PHASES, 0.0)
+
+    def record(self, timings: dict, pipelined: bool):
+        self.count += 1
+        self.pipelined += pipelined
+        for phase, seconds in timings.items():
+            self.last[phase] = seconds
+            self.total[phase] += seconds
+
+    def as_dict(self) -> dict:
+        stats = {'auth_count': self.count, 'auth_pipelined': self.pipelined}
+        for phase in self.PHASES:
+            stats[f'auth_{phase}_ms'] = self.last[phase] * 1000
+            stats[f'auth_{phase}_avg_ms'] = (
+                self.total[phase] / self.count * 1000 if self.count else 0.0
+            )
+        return stats
+
+
+token_cache = TokenCache()
+auth_metrics = AuthMetrics()
+sequential_auth_servers = set()
+
+
+async def authorize(
+    lines,
+    writer,
+    logger,
+    token_file,
+    token=None,
+    pipeline: bool=True,
+    pipeline_timeout: float=1.0,
+):
+    """
+        Авторизация по токену -> имя пользователя. Ответы сервера
+        читаются через <lines> (utils.LineFramer соединения), так что
+        данные после приветствия остаются в нём. Токен берётся
+        из token_cache. При <pipeline> токен отправляется, не дожидаясь
+        приветствия сервера; если сервер не ответил на такой токен за
+        <pipeline_timeout> секунд, для него включается обычный порядок
+        и вызывается ConnectionError (соединение переоткрывается).
+    """
+    started_at = phase_started_at = time.monotonic()
+    timings = {}
+
+    def finish_phase(phase):
+        nonlocal phase_started_at
+        now = time.monotonic()
+        timings[phase] = now - phase_started_at
+        phase_started_at = now
+
+    server = writer.get_extra_info('peername')
+    pipeline = pipeline and server not in sequential_auth_servers
     if not token:
-        async with aiofiles.open(token_file, mode='r') as token_file:
-            token = await token_file.read()
+        token = await token_cache.get(token_file)
+    finish_phase('token')
+
+    if pipeline:
+        await write_to_socket(writer, f'{token.rstrip()}\n', logger)
+    await lines.read_line()
+    finish_phase('greeting')
+
+    if not pipeline:
+        await write_to_socket(writer, f'{token.rstrip()}\n', logger)
+    try:
+        async with async_timeout(pipeline_timeout if pipeline else None) as _:
+            json_response = await lines.read_line()
+    except asyncio.exceptions.TimeoutError:
+        sequential_auth_servers.add(server)
+        raise ConnectionError('Server did not answer pipelined token')
+    finish_phase('response')
 
-    await write_to_socket(writer, f'{token.rstrip()}\n', logger)
-    json_response = await read_and_print_from_socket(reader, logger)
     response = convert_json_string_to_object(json_response)
     if not response:
         logger.debug(
             'Неизвестный токен. Проверьте его или зарегистрируйте заново.',
         )
+        token_cache.invalidate(token_file)
         raise InvalidToken()
 
-    await read_and_print_from_socket(reader, logger)
+    await lines.read_line()
+    finish_phase('welcome')
+    timings['total'] = time.monotonic() - started_at
+    auth_metrics.record(timings, pipeline)
     return response['nickname']
 
 
+async def request_account(lines, writer, name: str, logger):
+    """
+        Регистрация нового пользователя на открытом соединении
+        (<lines> - utils.LineFramer этого соединения)
+        -> ответ сервера {'nickname', 'account_hash'} или None.
+    """
+    await lines.read_line()
+    await write_to_socket(writer, '\n', logger)
+    await lines.read_line()
+
+    await write_to_socket(
+        writer,
+        '{}\n'.format(name.replace("\n", "\\n")),
+        logger,
+    )
+
+    json_response = await lines.read_line()
+    return convert_json_string_to_object(json_response) or None
+
+
 async def register(
     host: str,
     port: str,
@@ -58,18 +233,8 @@ async def register(
     logger,
 ):
     async with open_connection(host, port, logger) as (reader, writer):
-        await read_and_print_from_socket(reader, logger)
-        await write_to_socket(writer, '\n', logger)
-        await read_and_print_from_socket(reader, logger)
-
-        await write_to_socket(
-            writer,
-            '{}\n'.format(name.replace("\n", "\\n")),
-            logger,
-        )
-
-        json_response = await read_and_print_from_socket(reader, logger)
-        response = convert_json_string_to_object(json_response)
+        lines = LineFramer(reader, logger)
+        response = await request_account(lines, writer, name, logger)
         if not response:
             logger.debug('Не удалось получить токен. Повторите попытку.')
             await close_connection(writer, logger)
@@ -0,0 +1,384 @@
+import argparse
+import asyncio
+import logging
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import states
+from auntification import auth_metrics, authorize, register
+from fake_server import FakeChatServer
+from liveness import LivenessMonitor
+from logs import add_logging_arguments, setup_logging
+from outbox import Outbox
+from server import handle_connection, read_msgs, send_msgs
+from utils import (
+    get_parser,
+    open_connection,
+    reconnect_policy,
+    LineFramer,
+    MAX_LINE_LENGTH,
+)
+
+client_logger = logging.getLogger('benchmark.client')
+
+
+def parse_arguments():
+    """Обработка аргументов командной строки."""
+    parser = get_parser(
+        'Offline load test of chat client against a local fake server.',
+        'config.conf',
+    )
+    parser.add_arg(
+        '--scenarios',
+        default='ingest,send,reconnect',
+        help='Comma separated scenarios: ingest, send, reconnect',
+    )
+    parser.add_arg(
+        '--clients',
+        type=int,
+        default=1,
+        help='Number of reading clients in ingest scenario',
+    )
+    parser.add_arg(
+        '--messages',
+        type=int,
+        default=100000,
+        help='Number of messages broadcast in ingest scenario',
+    )
+    parser.add_arg(
+        '--rate',
+        type=float,
+        default=0,
+        help='Broadcast messages per second in ingest scenario (0 - max)',
+    )
+    parser.add_arg(
+        '--senders',
+        type=int,
+        default=1,
+        help='Number of sending clients in send scenario',
+    )
+    parser.add_arg(
+        '--send_messages',
+        type=int,
+        default=1000,
+        help='Number of messages sent by every sender',
+    )
+    parser.add_arg(
+        '--send_rate',
+        type=float,
+        default=100,
+        help='Messages per second sent by every sender (0 - max)',
+    )
+    parser.add_arg(
+        '--reconnect_rounds',
+        type=int,
+        default=3,
+        help='Number of forced disconnects in reconnect scenario',
+    )
+    parser.add_arg(
+        '--reconnect_delay',
+        type=float,
+        default=0.5,
+        help='Base delay before reconnect',
+    )
+    parser.add_arg(
+        '--trace_memory',
+        action='store_true',
+        help='Measure memory growth with tracemalloc (slows down ingest)',
+    )
+    add_logging_arguments(parser, 'WARNING')
+    config, _ = parser.parse_known_args()
+    return config
+
+
+def report(scenario: str, **values):
+    formatted = ', '.join(
+        f'{name}={value:.4g}' if isinstance(value, float) else
+        f'{name}={value}'
+        for name, value in values.items()
+    )
+    print(f'[{scenario}] {formatted}')
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def wait_for(condition, timeout: float=10, interval: float=0.01):
+    """Ожидание выполнения условия не дольше <timeout> секунд."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError('Benchmark condition was not met in time')
+        await asyncio.sleep(interval)
+
+
+def start_reader(chat_server, messages_queue):
+    """Клиент чтения на базе server.read_msgs."""
+    return asyncio.create_task(read_msgs(
+        messages_queue,
+        asyncio.Queue(),
+        asyncio.Queue(),
+        LivenessMonitor(),
+        chat_server.host,
+        chat_server.read_port,
+        client_logger,
+    ))
+
+
+async def cancel_tasks(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def count_messages(messages_queue, expected: int):
+    received = 0
+    while received < expected:
+        received += len(await messages_queue.get())
+
+
+async def bench_ingest(chat_server, clients: int, count: int, rate: float):
+    """Скорость приёма сообщений клиентами read_msgs."""
+    queues = [asyncio.Queue() for _ in range(clients)]
+    readers = [start_reader(chat_server, queue) for queue in queues]
+    await wait_for(lambda: len(chat_server.readers) == clients)
+
+    memory_before = tracemalloc.get_traced_memory()[0]
+    started_at = time.monotonic()
+    generator = asyncio.create_task(chat_server.generate(rate, count))
+    await asyncio.gather(*[count_messages(queue, count) for queue in queues])
+    elapsed = time.monotonic() - started_at
+    memory_after, memory_peak = tracemalloc.get_traced_memory()
+
+    await cancel_tasks(readers + [generator])
+    report(
+        'ingest',
+        clients=clients,
+        messages=count,
+        seconds=elapsed,
+        per_client_rate=count / elapsed,
+        total_rate=count * clients / elapsed,
+        dropped_clients=chat_server.dropped_readers,
+    )
+    if tracemalloc.is_tracing():
+        report(
+            'ingest',
+            memory_growth_kb=(memory_after - memory_before) / 1024,
+            memory_peak_kb=memory_peak / 1024,
+        )
+
+
+async def register_account(chat_server, name: str, token_file: str):
+    started_at = time.monotonic()
+    await register(
+        chat_server.host,
+        chat_server.write_port,
+        name,
+        token_file,
+        asyncio.Queue(),
+        asyncio.Queue(),
+        client_logger,
+    )
+    return time.monotonic() - started_at
+
+
+async def measure_authorize(chat_server, token_file: str) -> float:
+    async with open_connection(
+        chat_server.host,
+        chat_server.write_port,
+        client_logger,
+    ) as (reader, writer):
+        started_at = time.monotonic()
+        await authorize(
+            LineFramer(reader, client_logger),
+            writer,
+            client_logger,
+            token_file,
+        )
+        return time.monotonic() - started_at
+
+
+async def send_paced(sending_queue, sender: int, count: int, rate, sent_at):
+    started_at = time.monotonic()
+    for number in range(count):
+        text = f'bench {sender} {number}'
+        sent_at[text] = time.monotonic()
+        sending_queue.put_nowait(text)
+        if rate:
+            delay = started_at + (number + 1) / rate - time.monotonic()
+            await asyncio.sleep(max(delay, 0))
+        elif not number % 100:
+            await asyncio.sleep(0)
+
+
+async def collect_latencies(messages_queue, sent_at, latencies, expected):
+    while len(latencies) < expected:
+        messages = await messages_queue.get()
+        received_at = time.monotonic()
+        for message in messages:
+            if message.body in sent_at:
+                latencies.append(received_at - sent_at.pop(message.body))
+
+
+async def bench_send(chat_server, senders: int, count: int, rate: float):
+    """Регистрация, авторизация и задержка доставки send_msgs."""
+    token_dir = tempfile.mkdtemp(prefix='minechat-bench-')
+    token_files = [
+        str(Path(token_dir) / f'token_{sender}.txt')
+        for sender in range(senders)
+    ]
+    register_times = [
+        await register_account(chat_server, f'bench{sender}', token_file)
+        for sender, token_file in enumerate(token_files)
+    ]
+    authorize_times = [
+        await measure_authorize(chat_server, token_file)
+        for token_file in token_files
+    ]
+
+    messages_queue = asyncio.Queue()
+    reader = start_reader(chat_server, messages_queue)
+    await wait_for(lambda: chat_server.readers)
+
+    sending_queues = [Outbox() for _ in range(senders)]
+    sending_tasks = [
+        asyncio.create_task(send_msgs(
+            sending_queue,
+            asyncio.Queue(),
+            LivenessMonitor(),
+            chat_server.host,
+            chat_server.write_port,
+            client_logger,
+            token_file,
+        ))
+        for sending_queue, token_file in zip(sending_queues, token_files)
+    ]
+    await wait_for(lambda: len(chat_server.writers) == senders)
+
+    sent_at = {}
+    latencies = []
+    started_at = time.monotonic()
+    await asyncio.gather(
+        collect_latencies(messages_queue, sent_at, latencies, senders * count),
+        *[
+            send_paced(sending_queue, sender, count, rate, sent_at)
+            for sender, sending_queue in enumerate(sending_queues)
+        ],
+    )
+    elapsed = time.monotonic() - started_at
+
+    await cancel_tasks(sending_tasks + [reader])
+    report(
+        'send',
+        register_avg_ms=statistics.mean(register_times) * 1000,
+        authorize_avg_ms=statistics.mean(authorize_times) * 1000,
+    )
+    report('send', **{
+        name: value for name, value in auth_metrics.as_dict().items()
+        if not name.endswith('_avg_ms') or name == 'auth_total_avg_ms'
+    })
+    report(
+        'send',
+        senders=senders,
+        messages=len(latencies),
+        rate=len(latencies) / elapsed,
+        latency_p50_ms=percentile(latencies, 0.5) * 1000,
+        latency_p95_ms=percentile(latencies, 0.95) * 1000,
+        latency_max_ms=max(latencies) * 1000,
+    )
+
+
+async def wait_for_connection_states(status_queue, states):
+    states = set(states)
+    while states:
+        states.discard(await status_queue.get())
+
+
+async def bench_reconnect(chat_server, rounds: int):
+    """Время восстановления соединений handle_connection после разрыва."""
+    token_dir = tempfile.mkdtemp(prefix='minechat-bench-')
+    token_file = str(Path(token_dir) / 'token.txt')
+    await register_account(chat_server, 'reconnect', token_file)
+
+    args = argparse.Namespace(
+        host=chat_server.host,
+        read_port=chat_server.read_port,
+        write_port=chat_server.write_port,
+        max_line_length=MAX_LINE_LENGTH,
+        long_lines='truncate',
+    )
+    status_queue = asyncio.Queue()
+    established = (
+        states.ReadConnectionStateChanged.ESTABLISHED,
+        states.SendingConnectionStateChanged.ESTABLISHED,
+    )
+    connection = asyncio.create_task(handle_connection(
+        args,
+        asyncio.Queue(),
+        asyncio.Queue(),
+        status_queue,
+        LivenessMonitor(),
+        Outbox(),
+        client_logger,
+        client_logger,
+        token_file,
+    ))
+    await wait_for_connection_states(status_queue, established)
+
+    reconnect_times = []
+    for _ in range(rounds):
+        await asyncio.sleep(reconnect_policy.stable_period)
+        while not status_queue.empty():
+            status_queue.get_nowait()
+        started_at = time.monotonic()
+        chat_server.drop_connections()
+        await wait_for_connection_states(status_queue, established)
+        reconnect_times.append(time.monotonic() - started_at)
+
+    await cancel_tasks([connection])
+    report(
+        'reconnect',
+        rounds=rounds,
+        avg_ms=statistics.mean(reconnect_times) * 1000,
+        max_ms=max(reconnect_times) * 1000,
+        **reconnect_policy.as_dict(),
+    )
+
+
+async def main():
+    args = parse_arguments()
+    setup_logging(args)
+    reconnect_policy.configure(args.reconnect_delay, 30, 1)
+    if args.trace_memory:
+        tracemalloc.start()
+
+    chat_server = FakeChatServer()
+    await chat_server.start()
+    scenarios = args.scenarios.split(',')
+    try:
+        if 'ingest' in scenarios:
+            await bench_ingest(
+                chat_server,
+                args.clients,
+                args.messages,
+                args.rate,
+            )
+        if 'send' in scenarios:
+            await bench_send(
+                chat_server,
+                args.senders,
+                args.send_messages,
+                args.send_rate,
+            )
+        if 'reconnect' in scenarios:
+            await bench_reconnect(chat_server, args.reconnect_rounds)
+    finally:
+        await chat_server.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
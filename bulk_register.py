@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import random
+import sys
+import time
+from anyio import create_task_group
+from async_timeout import timeout as async_timeout
+from auntification import TokenStore, request_account
+from logs import add_logging_arguments, setup_logging
+from metrics import metrics
+from utils import get_parser, open_connection, LineFramer
+
+logger = logging.getLogger('bulk_register')
+connection_logger = logging.getLogger('bulk_register.connection')
+
+
+def parse_arguments():
+    """Обработка аргументов командной строки."""
+    parser = get_parser(
+        'Register many chat accounts concurrently.',
+        'config.conf',
+    )
+    parser.add_arg(
+        '-ho',
+        '--host',
+        help='Server HOST',
+    )
+    parser.add_arg(
+        '-wp',
+        '--write_port',
+        help='Server PORT to write messages',
+    )
+    parser.add_arg(
+        '--names',
+        default='-',
+        help='File with one account name per line (- for stdin)',
+    )
+    parser.add_arg(
+        '--token_store',
+        default='tokens.jsonl',
+        help='File of registered tokens keyed by account name',
+    )
+    parser.add_arg(
+        '--connections',
+        type=int,
+        default=20,
+        help='Max number of simultaneous registration connections',
+    )
+    parser.add_arg(
+        '--attempts',
+        type=int,
+        default=3,
+        help='Registration attempts per account',
+    )
+    parser.add_arg(
+        '--attempt_timeout',
+        type=float,
+        default=3,
+        help='Seconds for one registration attempt',
+    )
+    parser.add_arg(
+        '--retry_delay',
+        type=float,
+        default=0.5,
+        help='Base delay in seconds between attempts (doubles each time)',
+    )
+    parser.add_arg(
+        '--report_interval',
+        type=float,
+        default=5,
+        help='Seconds between progress reports',
+    )
+    add_logging_arguments(parser, 'INFO')
+    config, _ = parser.parse_known_args()
+    return config
+
+
+def load_names(names_path: str, token_store) -> list:
+    """
+        Имена из файла (или stdin) без пустых строк, комментариев,
+        повторов и уже зарегистрированных в <token_store>.
+    """
+    if names_path == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(names_path, encoding='utf-8') as names_file:
+            lines = names_file.readlines()
+
+    names = {}
+    for line in lines:
+        name = line.strip()
+        if name and not name.startswith('#') and name not in token_store:
+            names[name] = None
+    return list(names)
+
+
+class BulkStats:
+    """Счётчики массовой регистрации."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.registered = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failed = {}
+        self.latencies = []
+        self.started_at = time.monotonic()
+
+    def as_dict(self) -> dict:
+        seconds = time.monotonic() - self.started_at
+        latencies = sorted(self.latencies) or [0.0]
+        return {
+            'accounts': self.total,
+            'registered': self.registered,
+            'failed': len(self.failed),
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'seconds': seconds,
+            'rate': self.registered / seconds if seconds else 0.0,
+            'latency_p50_ms': latencies[len(latencies) // 2] * 1000,
+            'latency_max_ms': latencies[-1] * 1000,
+        }
+
+
+def format_stats(stats: dict) -> str:
+    return ', '.join(
+        f'{name}={value:.4g}' if isinstance(value, float) else
+        f'{name}={value}'
+        for name, value in stats.items()
+    )
+
+
+async def register_account(name: str, args, stats):
+    """
+        Регистрация одного пользователя с повторами
+        -> запись для TokenStore или None.
+    """
+    error = None
+    for attempt in range(args.attempts):
+        if attempt:
+            stats.retries += 1
+            await asyncio.sleep(
+                random.uniform(0, args.retry_delay * 2 ** (attempt - 1)),
+            )
+        stats.attempts += 1
+        started_at = time.monotonic()
+        try:
+            async with async_timeout(args.attempt_timeout) as _:
+                async with open_connection(
+                    args.host,
+                    args.write_port,
+                    connection_logger,
+                ) as (reader, writer):
+                    response = await request_account(
+                        LineFramer(reader, connection_logger),
+                        writer,
+                        name,
+                        connection_logger,
+                    )
+        except asyncio.exceptions.TimeoutError:
+            error = 'timeout'
+            continue
+        except OSError as ex:
+            error = str(ex) or type(ex).__name__
+            continue
+
+        if not response:
+            error = 'server did not return a token'
+            continue
+        stats.latencies.append(time.monotonic() - started_at)
+        return {
+            'name': name,
+            'nickname': response['nickname'],
+            'token': response['account_hash'],
+        }
+
+    stats.failed[name] = error
+    logger.warning(f'Не удалось зарегистрировать {name!r}: {error}')
+    return None
+
+
+async def register_worker(names_queue, registered: list, args, stats):
+    """Регистрация имён из очереди по одному, каждое - в новом соединении."""
+    while not names_queue.empty():
+        name = names_queue.get_nowait()
+        entry = await register_account(name, args, stats)
+        if entry:
+            stats.registered += 1
+            metrics.inc('accounts_registered')
+            registered.append(entry)
+        else:
+            metrics.inc('accounts_failed')
+
+
+async def save_tokens(token_store, registered: list, interval: float=1):
+    """Периодическая запись зарегистрированных токенов в хранилище."""
+    while True:
+        await asyncio.sleep(interval)
+        entries = registered[:]
+        await token_store.add(entries)
+        # Удаляются только записанные: при отмене во время записи
+        # они остаются для финальной записи в register_all.
+        del registered[:len(entries)]
+
+
+async def report_progress(stats, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(format_stats(stats.as_dict()))
+
+
+async def register_all(names, token_store, args) -> BulkStats:
+    """
+        Регистрация <names> не более чем через <args.connections>
+        одновременных соединений. Токены дописываются в <token_store>
+        по мере регистрации, так что прерванный запуск можно продолжить.
+    """
+    stats = BulkStats(len(names))
+    names_queue = asyncio.Queue()
+    for name in names:
+        names_queue.put_nowait(name)
+    registered = []
+
+    try:
+        async with create_task_group() as tg:
+            tg.start_soon(save_tokens, token_store, registered)
+            tg.start_soon(report_progress, stats, args.report_interval)
+            async with create_task_group() as workers:
+                for _ in range(max(1, min(args.connections, len(names)))):
+                    workers.start_soon(
+                        register_worker,
+                        names_queue,
+                        registered,
+                        args,
+                        stats,
+                    )
+            tg.cancel_scope.cancel()
+    finally:
+        await token_store.add(registered)
+    return stats
+
+
+def main():
+    args = parse_arguments()
+    setup_logging(args)
+    token_store = TokenStore(args.token_store).load()
+    names = load_names(args.names, token_store)
+    if not names:
+        logger.info('Нет новых имён для регистрации.')
+        return
+
+    logger.info(
+        f'Регистрация {len(names)} пользователей, '
+        f'{len(token_store)} уже в {args.token_store}',
+    )
+    try:
+        stats = asyncio.run(register_all(names, token_store, args))
+    except KeyboardInterrupt:
+        return
+
+    logger.info(format_stats(stats.as_dict()))
+    if stats.failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
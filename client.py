@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import logging
+import sys
+from anyio import create_task_group
+from auntification import InvalidToken
+from dedup import ReplayFilter, prime_from_history
+from history import HistoryIndex, HistoryReader, save_messages
+from liveness import LivenessMonitor
+from logs import add_logging_arguments, setup_logging
+from message import MessageCounter
+from outbox import Outbox
+from queues import DEFAULT_QUEUE_LIMITS, create_queue
+from server import handle_connection
+from utils import get_parser, MAX_LINE_LENGTH
+
+TOKEN_FILE_PATH = 'token.txt'
+
+logger = logging.getLogger('client')
+watchdog_logger = logging.getLogger('watchdog')
+
+
+async def drain_queue(queue):
+    """Очистка очереди, у которой нет потребителя."""
+    while True:
+        await queue.get()
+
+
+class ChatClient:
+    """
+        Клиент чата без Tk: входящие сообщения читаются асинхронным
+        итератором, исходящие отправляются через send().
+        Соединения обслуживает server.handle_connection.
+        Если итератор отстаёт больше чем на лимит очереди messages,
+        старые сообщения теряются (messages_queue.dropped); пропуски
+        видны по номерам message.seq.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        read_port: int,
+        write_port: int,
+        token_file_path: str=TOKEN_FILE_PATH,
+        history: str=None,
+        outbox: str=None,
+        queue_limits: dict=None,
+        max_line_length: int=MAX_LINE_LENGTH,
+        long_lines: str='truncate',
+        logger=logger,
+        watchdog_logger=watchdog_logger,
+    ):
+        self.args = argparse.Namespace(
+            host=host,
+            read_port=read_port,
+            write_port=write_port,
+            max_line_length=max_line_length,
+            long_lines=long_lines,
+        )
+        self.token_file_path = token_file_path
+        self.history = history
+        self.logger = logger
+        self.watchdog_logger = watchdog_logger
+        queue_limits = queue_limits or DEFAULT_QUEUE_LIMITS
+        self.messages_queue = create_queue('messages', queue_limits)
+        self.messages_history_queue = create_queue('history', queue_limits)
+        self.sending_queue = Outbox(
+            outbox,
+            maxsize=queue_limits['sending'][0],
+        )
+        self.status_updates_queue = create_queue('status', queue_limits)
+        self.liveness = LivenessMonitor()
+        self.replay_filter = ReplayFilter()
+        self._task = None
+        self._error_reported = False
+
+    async def run(self):
+        """Работа с сервером до отмены (или InvalidToken)."""
+        history_index = None
+        message_counter = MessageCounter()
+        if self.history:
+            history_index = HistoryIndex(self.history)
+            await history_index.load()
+            prime_from_history(
+                self.replay_filter,
+                HistoryReader(self.history, history_index),
+                1000,
+            )
+            message_counter = MessageCounter(len(history_index))
+        async with create_task_group() as tg:
+            tg.start_soon(
+                handle_connection,
+                self.args,
+                self.messages_queue,
+                self.messages_history_queue,
+                self.status_updates_queue,
+                self.liveness,
+                self.sending_queue,
+                self.logger,
+                self.watchdog_logger,
+                self.token_file_path,
+                self.replay_filter,
+                message_counter,
+            )
+
+            if self.history:
+                tg.start_soon(
+                    save_messages,
+                    self.history,
+                    self.messages_history_queue,
+                    64 * 1024,
+                    1.0,
+                    0,
+                    history_index,
+                )
+            else:
+                tg.start_soon(drain_queue, self.messages_history_queue)
+
+    async def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка клиента; ошибка работы пробрасывается один раз."""
+        if not self._task:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            if not self._error_reported:
+                raise
+        finally:
+            self.sending_queue.close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def _get(self, queue):
+        """
+            Элемент очереди; если клиент остановился с ошибкой,
+            ошибка пробрасывается вместо бесконечного ожидания.
+        """
+        getter = asyncio.ensure_future(queue.get())
+        await asyncio.wait(
+            {getter, self._task},
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if getter.done():
+            return getter.result()
+        getter.cancel()
+        self._error_reported = True
+        self._task.result()
+        raise ConnectionError('Chat client stopped')
+
+    async def messages(self):
+        """Асинхронный итератор входящих сообщений."""
+        while True:
+            for message in await self._get(self.messages_queue):
+                yield message
+
+    def __aiter__(self):
+        return self.messages()
+
+    async def statuses(self):
+        """Асинхронный итератор изменений состояния соединений."""
+        while True:
+            yield await self._get(self.status_updates_queue)
+
+    async def send(self, message: str):
+        """Постановка сообщения в очередь отправки (и журнал outbox)."""
+        await self.sending_queue.put(message)
+
+
+def parse_arguments():
+    """Обработка аргументов командной строки."""
+    parser = get_parser(
+        'Headless chat client: prints messages, sends lines from stdin.',
+        'config.conf',
+    )
+    parser.add_arg(
+        '-ho',
+        '--host',
+        help='Server HOST',
+    )
+    parser.add_arg(
+        '-rp',
+        '--read_port',
+        help='Server PORT to read messages',
+    )
+    parser.add_arg(
+        '-wp',
+        '--write_port',
+        help='Server PORT to write messages',
+    )
+    parser.add_arg(
+        '-hi',
+        '--history',
+        help='File to store messages',
+    )
+    parser.add_arg(
+        '--token_file',
+        default=TOKEN_FILE_PATH,
+        help='File with account token',
+    )
+    parser.add_arg(
+        '--outbox',
+        help='File to keep outgoing messages until they are sent',
+    )
+    parser.add_arg(
+        '--send_stdin',
+        action='store_true',
+        help='Send every line read from stdin to chat',
+    )
+    add_logging_arguments(parser, 'WARNING')
+    config, _ = parser.parse_known_args()
+    return config
+
+
+async def send_from_stdin(chat_client):
+    """Отправка строк из stdin до его закрытия."""
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            return
+        await chat_client.send(line.rstrip('\n'))
+
+
+async def print_messages(chat_client):
+    async for message in chat_client:
+        print(message, flush=True)
+
+
+async def run_headless():
+    """Запуск клиента без интерфейса."""
+    args = parse_arguments()
+    setup_logging(args)
+    async with ChatClient(
+        args.host,
+        args.read_port,
+        args.write_port,
+        args.token_file,
+        args.history,
+        args.outbox,
+    ) as chat_client:
+        async with create_task_group() as tg:
+            tg.start_soon(print_messages, chat_client)
+            if args.send_stdin:
+                tg.start_soon(send_from_stdin, chat_client)
+
+
+def main():
+    try:
+        asyncio.run(run_headless())
+    except InvalidToken:
+        logger.error(
+            'Неизвестный токен. Проверьте его или зарегистрируйте заново.',
+        )
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+from collections import deque
+from message import line_text
+
+# Примерная память на одно сообщение окна: int хэша, запись
+# словаря счётчиков и ссылка в deque.
+ENTRY_SIZE = 120
+
+
+class ReplayFilter:
+    """
+        Отсев сообщений, которые сервер присылает повторно после
+        переподключения. Хэши текстов последних сообщений хранятся
+        в скользящем окне размером не больше <memory_budget> байт.
+        После нового соединения сообщения, уже бывшие в окне,
+        отбрасываются, пока не придёт первое новое сообщение:
+        дальше повторы считаются настоящими и пропускаются.
+    """
+
+    def __init__(self, memory_budget: int=1024 * 1024):
+        self.max_entries = max(1, memory_budget // ENTRY_SIZE)
+        self.replaying = False
+        self.dropped = 0
+        self._hashes = deque()
+        self._counts = {}
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def _remember(self, text_hash: int):
+        self._hashes.append(text_hash)
+        self._counts[text_hash] = self._counts.get(text_hash, 0) + 1
+        if len(self._hashes) > self.max_entries:
+            oldest = self._hashes.popleft()
+            count = self._counts.pop(oldest) - 1
+            if count:
+                self._counts[oldest] = count
+
+    def prime(self, lines):
+        """Заполнение окна строками истории «[дата] автор: текст»."""
+        for line in lines:
+            self._remember(hash(line_text(str(line))))
+
+    def start_connection(self):
+        """Новое соединение: начало возможного повтора."""
+        self.replaying = True
+
+    def filter(self, messages):
+        """Сообщения пачки без повторов (message.Message)."""
+        if not self.replaying:
+            for message in messages:
+                self._remember(hash(message.text))
+            return messages
+
+        new_messages = []
+        for message in messages:
+            text_hash = hash(message.text)
+            if self.replaying and text_hash in self._counts:
+                self.dropped += 1
+                continue
+            self.replaying = False
+            self._remember(text_hash)
+            new_messages.append(message)
+        return new_messages
+
+
+def prime_from_history(replay_filter, history_reader, count: int):
+    """Последние <count> сообщений истории - в окно replay_filter."""
+    if count:
+        replay_filter.prime(history_reader.read_last(count))
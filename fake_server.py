@@ -0,0 +1,246 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from logs import add_logging_arguments, setup_logging
+from utils import get_parser
+
+GREETING = (
+    'Hello %username%! Enter your personal hash '
+    'or leave it empty to create new account.\n'
+)
+NICKNAME_PROMPT = 'Enter preferred nickname below:\n'
+WELCOME = (
+    'Welcome to chat! Post your message below. '
+    'End it with an empty line.\n'
+)
+
+logger = logging.getLogger('fake_server')
+
+
+class FakeChatServer:
+    """
+        Локальная замена сервера minechat: порт чтения рассылает
+        сообщения всем подключённым, порт записи принимает токен
+        (или регистрирует нового пользователя) и сообщения чата.
+    """
+
+    def __init__(
+        self,
+        host: str='127.0.0.1',
+        read_port: int=0,
+        write_port: int=0,
+        backlog: int=0,
+        max_write_buffer: int=4 * 1024 * 1024,
+    ):
+        self.host = host
+        self.read_port = read_port
+        self.write_port = write_port
+        self.max_write_buffer = max_write_buffer
+        self.accounts = {}
+        self.readers = set()
+        self.writers = set()
+        self.recent_messages = deque(maxlen=backlog)
+        self.broadcast_count = 0
+        self.dropped_readers = 0
+        self._servers = []
+
+    async def start(self):
+        """Запуск серверов; порт 0 заменяется выбранным системой."""
+        read_server = await asyncio.start_server(
+            self.handle_reader,
+            self.host,
+            self.read_port,
+        )
+        write_server = await asyncio.start_server(
+            self.handle_writer,
+            self.host,
+            self.write_port,
+        )
+        self._servers = [read_server, write_server]
+        self.read_port = read_server.sockets[0].getsockname()[1]
+        self.write_port = write_server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self.drop_connections()
+
+    def drop_connections(self):
+        """Разрыв всех клиентских соединений (имитация рестарта)."""
+        for writer in list(self.readers) + list(self.writers):
+            writer.close()
+        self.readers.clear()
+        self.writers.clear()
+
+    def register(self, nickname: str) -> dict:
+        account = {
+            'nickname': nickname,
+            'account_hash': uuid.uuid4().hex,
+        }
+        self.accounts[account['account_hash']] = account
+        return account
+
+    def broadcast(self, text: str):
+        """Отправка строки всем читателям; отстающие отключаются."""
+        data = f'{text}\n'.encode()
+        self.recent_messages.append(data)
+        self.broadcast_count += 1
+        for writer in list(self.readers):
+            buffered = writer.transport.get_write_buffer_size()
+            if buffered > self.max_write_buffer:
+                self.readers.discard(writer)
+                self.dropped_readers += 1
+                writer.close()
+                continue
+            writer.write(data)
+
+    async def generate(
+        self,
+        rate: float=0,
+        count: int=None,
+        batch_size: int=100,
+    ):
+        """
+            Поток сообщений для читателей: <rate> сообщений в секунду
+            (0 - без ограничения), всего <count> (None - бесконечно).
+        """
+        started_at = time.monotonic()
+        sent = 0
+        for number in itertools.count():
+            if count is not None and sent >= count:
+                return
+            self.broadcast(f'bot: generated message {number}')
+            sent += 1
+            if rate:
+                delay = started_at + sent / rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif not sent % batch_size:
+                await asyncio.sleep(0)
+
+    async def handle_reader(self, reader, writer):
+        self.readers.add(writer)
+        for data in self.recent_messages:
+            writer.write(data)
+        try:
+            await reader.read()
+        except ConnectionError:
+            pass
+        finally:
+            self.readers.discard(writer)
+            writer.close()
+
+    async def _authenticate(self, reader, writer):
+        writer.write(GREETING.encode())
+        token = (await reader.readline()).decode().strip()
+        if not token:
+            writer.write(NICKNAME_PROMPT.encode())
+            nickname = (await reader.readline()).decode().strip()
+            account = self.register(nickname.replace('\\n', ' '))
+        else:
+            account = self.accounts.get(token)
+        writer.write(f'{json.dumps(account)}\n'.encode())
+        if account:
+            writer.write(WELCOME.encode())
+        await writer.drain()
+        return account
+
+    async def handle_writer(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            account = await self._authenticate(reader, writer)
+            if not account:
+                return
+
+            lines = []
+            while not reader.at_eof():
+                line = (await reader.readline()).decode()
+                if not line:
+                    break
+                if line.strip():
+                    lines.append(line.rstrip('\n'))
+                    continue
+                if lines:
+                    text = '\\n'.join(lines)
+                    self.broadcast(f'{account["nickname"]}: {text}')
+                    lines = []
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+
+def parse_arguments():
+    """Обработка аргументов командной строки."""
+    parser = get_parser(
+        'Local minechat-compatible server for tests and benchmarks.',
+        'config.conf',
+    )
+    parser.add_arg(
+        '-rp',
+        '--read_port',
+        type=int,
+        help='PORT to serve chat messages',
+    )
+    parser.add_arg(
+        '-wp',
+        '--write_port',
+        type=int,
+        help='PORT to receive tokens, registrations and messages',
+    )
+    parser.add_arg(
+        '--listen',
+        default='127.0.0.1',
+        help='Address to listen on',
+    )
+    parser.add_arg(
+        '--rate',
+        type=float,
+        default=0,
+        help='Generated messages per second (0 - no generated traffic)',
+    )
+    parser.add_arg(
+        '--backlog',
+        type=int,
+        default=0,
+        help='Number of recent messages sent to every new reader',
+    )
+    add_logging_arguments(parser, 'INFO')
+    config, _ = parser.parse_known_args()
+    return config
+
+
+async def main():
+    args = parse_arguments()
+    setup_logging(args)
+    server = FakeChatServer(
+        args.listen,
+        args.read_port,
+        args.write_port,
+        args.backlog,
+    )
+    await server.start()
+    logger.info(
+        f'Listening on {args.listen}: read {server.read_port}, '
+        f'write {server.write_port}',
+    )
+    try:
+        if args.rate:
+            await server.generate(args.rate)
+        else:
+            await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -1,71 +1,373 @@
 import tkinter as tk
+import _tkinter
 import asyncio
+import time
+from collections import deque
 from anyio import create_task_group
+from async_timeout import timeout as async_timeout
 from tkinter.scrolledtext import ScrolledText
-from enum import Enum
+from metrics import RateMeter, metrics
+from states import (
+    ReadConnectionStateChanged,
+    SendingConnectionStateChanged,
+    NicknameReceived,
+    MessagesDelivered,
+    ConnectionStatsReceived,
+)
 
 
-class TkAppClosed(Exception):
-    pass
-
-
-class ReadConnectionStateChanged(Enum):
-    INITIATED = 'устанавливаем соединение'
-    ESTABLISHED = 'соединение установлено'
-    CLOSED = 'соединение закрыто'
-
-    def __str__(self):
-        return str(self.value)
-
-
-class SendingConnectionStateChanged(Enum):
-    INITIATED = 'устанавливаем соединение'
-    ESTABLISHED = 'соединение установлено'
-    CLOSED = 'соединение закрыто'
-
-    def __str__(self):
-        return str(self.value)
+TK_EVENTS_NO_WAIT = _tkinter.ALL_EVENTS | _tkinter.DONT_WAIT
 
 
-class NicknameReceived:
-    def __init__(self, nickname):
-        self.nickname = nickname
+class TkAppClosed(Exception):
+    pass
 
 
 def process_new_message(input_field, sending_queue):
     text = input_field.get()
-    sending_queue.put_nowait(text)
+    try:
+        sending_queue.put_nowait(text)
+    except asyncio.QueueFull:
+        input_field.bell()
+        return
     input_field.delete(0, tk.END)
 
 
-async def update_tk(root_frame, interval=1 / 120):
+def process_tk_events(root_frame, max_events: int=1000) -> int:
+    """Обработка накопившихся событий Tk без ожидания -> их количество."""
+    events_count = 0
+    while events_count < max_events:
+        if not root_frame.tk.dooneevent(TK_EVENTS_NO_WAIT):
+            break
+        events_count += 1
+    return events_count
+
+
+def tk_app_closed(root_frame) -> bool:
+    """
+        Окно закрыто? dooneevent() не сообщает о закрытии окна,
+        поэтому оно проверяется явно после обработки событий.
+    """
+    try:
+        return not root_frame.winfo_exists()
+    except tk.TclError:
+        return True
+
+
+async def update_tk(
+    root_frame,
+    interval=1 / 120,
+    max_interval: float=0.1,
+    wakeup=None,
+):
+    """
+        Обработка событий Tk. Пока событий нет, интервал опроса удваивается
+        до <max_interval>; при событиях Tk или по wakeup (asyncio.Event,
+        который выставляют обработчики очередей) возвращается к <interval>.
+    """
+    current_interval = interval
     while True:
-        try:
-            root_frame.update()
-        except tk.TclError:
+        frame_started_at = time.monotonic()
+        events_count = process_tk_events(root_frame)
+        if tk_app_closed(root_frame):
             raise TkAppClosed()
-        await asyncio.sleep(interval)
 
+        if events_count:
+            metrics.observe(
+                'tk_frame_seconds',
+                time.monotonic() - frame_started_at,
+            )
+            current_interval = interval
+        else:
+            current_interval = min(current_interval * 2, max_interval)
 
-async def update_conversation_history(panel, messages_queue):
+        if wakeup is None:
+            await asyncio.sleep(current_interval)
+            continue
+
+        try:
+            async with async_timeout(current_interval) as _:
+                await wakeup.wait()
+            current_interval = interval
+        except asyncio.exceptions.TimeoutError:
+            pass
+        wakeup.clear()
+
+
+class ConversationView:
+    """
+        Панель переписки, в которой хранится не больше <max_lines> строк.
+        Вытесненные строки лежат в истории и подгружаются страницами
+        при прокрутке к верхнему или нижнему краю панели.
+        Строки сопоставляются с историей по номерам message.seq;
+        сообщения без номера (строки из истории) продолжают нумерацию.
+        Если очередь вывода потеряла сообщения, панель перестаёт
+        следить за концом переписки (live) и взводит missed:
+        пропущенное подгружается из истории (catch_up_conversation).
+    """
+
+    def __init__(
+        self,
+        panel,
+        history_reader=None,
+        max_lines: int=1000,
+        page_size: int=200,
+    ):
+        self.panel = panel
+        self.history_reader = history_reader
+        self.max_lines = max_lines
+        self.page_size = page_size
+        self.received_seq = history_reader.first_seq if history_reader else 0
+        self.first_seq = self.received_seq
+        self.line_count = 0
+        self.live = True
+        self.recent_messages = deque(maxlen=max_lines)
+        self.missed = asyncio.Event()
+        self._version = 0
+
+    @property
+    def last_seq(self) -> int:
+        return self.first_seq + self.line_count
+
+    def _insert(self, index: str, messages):
+        text = '\n'.join(map(str, messages))
+        if self.line_count and index == '1.0':
+            text += '\n'
+        elif self.line_count:
+            text = '\n' + text
+        self.panel.insert(index, text)
+        self.line_count += len(messages)
+        self._version += 1
+
+    def _trim_top(self):
+        excess = self.line_count - self.max_lines
+        if excess <= 0:
+            return
+        if not self.live:
+            top_line = int(self.panel.index('@0,0').split('.')[0])
+        self.panel.delete('1.0', f'{excess + 1}.0')
+        self.first_seq += excess
+        self.line_count -= excess
+        if not self.live:
+            self.panel.yview(f'{max(top_line - excess, 1)}.0')
+
+    def _trim_bottom(self):
+        if self.line_count <= self.max_lines:
+            return
+        self.panel.delete(f'{self.max_lines}.end', 'end-1c')
+        self.line_count = self.max_lines
+        self.live = False
+
+    def _skip_gaps(self, messages):
+        """
+            Сообщения после последнего пропуска в нумерации
+            (и номер первого из них, если пропуск был).
+        """
+        gap_at = gap_seq = None
+        expected_seq = self.received_seq
+        for position, message in enumerate(messages):
+            seq = getattr(message, 'seq', None)
+            if seq is not None and seq != expected_seq:
+                gap_at, gap_seq, expected_seq = position, seq, seq
+            expected_seq += 1
+        if gap_at is None:
+            return messages, None
+        return messages[gap_at:], gap_seq
+
+    def append(self, messages):
+        """Новые сообщения: выводятся, только если панель показывает конец."""
+        messages, gap_seq = self._skip_gaps(messages)
+        if gap_seq is not None:
+            self.recent_messages.clear()
+            self.received_seq = gap_seq
+            if self.live and self.history_reader:
+                self.live = False
+                self.missed.set()
+        self.recent_messages.extend(messages)
+        self.received_seq += len(messages)
+        if not self.live:
+            return
+
+        if len(messages) > self.max_lines:
+            self.first_seq += self.line_count + len(messages) - self.max_lines
+            self.line_count = 0
+            messages = messages[-self.max_lines:]
+            self.panel['state'] = 'normal'
+            self.panel.delete('1.0', 'end')
+        else:
+            self.panel['state'] = 'normal'
+
+        self._insert('end', messages)
+        self._trim_top()
+        self.panel['state'] = 'disabled'
+        self.panel.yview(tk.END)
+
+    async def load_older(self):
+        """Подгрузка страницы истории перед первой показанной строкой."""
+        if not self.history_reader or not self.first_seq:
+            return
+        version = self._version
+        start = max(self.first_seq - self.page_size, 0)
+        messages = await self.history_reader.load_range(start, self.first_seq)
+        if not messages or version != self._version:
+            return
+
+        self.panel['state'] = 'normal'
+        self._insert('1.0', messages)
+        self.first_seq -= len(messages)
+        self.missed.clear()
+        self._trim_bottom()
+        self.panel['state'] = 'disabled'
+        self.panel.yview(f'{len(messages) + 1}.0')
+
+    async def load_newer(self):
+        """Подгрузка следующей страницы, пока панель не дойдёт до конца."""
+        if self.live:
+            return
+        version = self._version
+        recent_start = self.received_seq - len(self.recent_messages)
+        messages = []
+        if self.last_seq < recent_start:
+            messages = await self.history_reader.load_range(
+                self.last_seq,
+                min(self.last_seq + self.page_size, recent_start),
+            )
+            if not messages or version != self._version:
+                return
+        else:
+            skip = self.last_seq - recent_start
+            messages = list(self.recent_messages)[skip:skip + self.page_size]
+            self.live = self.last_seq + len(messages) >= self.received_seq
+
+        self.panel['state'] = 'normal'
+        if messages:
+            self._insert('end', messages)
+        self._trim_top()
+        self.panel['state'] = 'disabled'
+        if self.live:
+            self.panel.yview(tk.END)
+
+
+async def catch_up_conversation(
+    conversation_view,
+    tk_wakeup,
+    retry_interval: float=0.5,
+):
+    """
+        Подгрузка из истории сообщений, потерянных очередью вывода,
+        пока панель снова не дойдёт до конца переписки или пользователь
+        не начнёт листать историю назад. Если они ещё не записаны в
+        историю, подгрузка повторяется через <retry_interval> секунд.
+    """
+    while True:
+        await conversation_view.missed.wait()
+        while conversation_view.missed.is_set() and not conversation_view.live:
+            last_seq = conversation_view.last_seq
+            await conversation_view.load_newer()
+            tk_wakeup.set()
+            if conversation_view.last_seq == last_seq:
+                await asyncio.sleep(retry_interval)
+        conversation_view.missed.clear()
+
+
+async def page_conversation(load_page, scrolled_to_edge, tk_wakeup):
+    """Подгрузка страницы истории, когда панель прокручена до края."""
     while True:
-        msg = await messages_queue.get()
-        panel['state'] = 'normal'
+        await scrolled_to_edge.wait()
+        scrolled_to_edge.clear()
+        await load_page()
+        tk_wakeup.set()
 
-        if panel.index('end-1c') != '1.0':
-            panel.insert('end', '\n')
 
-        panel.insert('end', msg)
-        panel.yview(tk.END)
-        panel['state'] = 'disabled'
+def show_search_results(root, query: str, messages):
+    """Окно с найденными в истории сообщениями."""
+    results_window = tk.Toplevel(root)
+    results_window.title(f'Поиск: {query} ({len(messages)})')
 
+    results_panel = ScrolledText(results_window, wrap='none')
+    results_panel.pack(fill='both', expand=True)
+    results_panel.insert('end', '\n'.join(messages) or 'Ничего не найдено')
+    results_panel.yview(tk.END)
+    results_panel['state'] = 'disabled'
 
-async def update_status_panel(status_labels, status_updates_queue):
-    nickname_label, read_label, write_label = status_labels
+
+async def search_history(root, history_reader, search_queue, tk_wakeup):
+    """Поиск по истории для запросов из search_queue."""
+    while True:
+        query = await search_queue.get()
+        if not query:
+            continue
+        messages = await history_reader.find(query)
+        show_search_results(root, query, messages)
+        tk_wakeup.set()
+
+
+async def update_conversation_history(
+    conversation_view,
+    messages_queue,
+    tk_wakeup,
+    display_rate: float=0,
+):
+    """
+        Вывод сообщений из messages_queue: все пачки, накопившиеся к
+        моменту отрисовки, добавляются в панель одной вставкой.
+        При <display_rate> > 0 выводится не больше <display_rate>
+        сообщений в секунду.
+    """
+    while True:
+        messages = list(await messages_queue.get())
+        while not messages_queue.empty():
+            messages.extend(messages_queue.get_nowait())
+        if not messages:
+            continue
+
+        if not display_rate:
+            conversation_view.append(messages)
+            tk_wakeup.set()
+            continue
+
+        step = max(1, int(display_rate / 10))
+        for start in range(0, len(messages), step):
+            messages_slice = messages[start:start + step]
+            conversation_view.append(messages_slice)
+            tk_wakeup.set()
+            await asyncio.sleep(len(messages_slice) / display_rate)
+
+
+def format_connection_stats(stats: dict) -> str:
+    """Простой и задержка соединений для панели статуса."""
+    titles = {'read': 'чтение', 'send': 'отправка'}
+    parts = []
+    for name, connection in stats.items():
+        text = (
+            f'{titles.get(name, name)}: простой {connection["idle"]:.1f} с '
+            f'(макс. {connection["max_idle"]:.1f} с)'
+        )
+        if connection['latency'] is not None:
+            text += f', задержка {connection["latency"] * 1000:.0f} мс'
+        parts.append(text)
+    return '; '.join(parts)
+
+
+async def update_status_panel(
+    status_labels,
+    status_updates_queue,
+    tk_wakeup=None,
+):
+    (
+        nickname_label,
+        read_label,
+        write_label,
+        delivery_label,
+        liveness_label,
+    ) = status_labels
 
     read_label['text'] = 'Чтение: нет соединения'
     write_label['text'] = 'Отправка: нет соединения'
     nickname_label['text'] = 'Имя пользователя: неизвестно'
+    delivery_label['text'] = 'Доставлено: 0, в очереди: 0'
+    liveness_label['text'] = ''
+    delivered_count = 0
 
     while True:
         msg = await status_updates_queue.get()
@@ -78,6 +380,54 @@ async def update_status_panel(status_labels, status_updates_queue):
         if isinstance(msg, NicknameReceived):
             nickname_label['text'] = f'Имя пользователя: {msg.nickname}'
 
+        if isinstance(msg, MessagesDelivered):
+            delivered_count += len(msg.messages)
+            delivery_label['text'] = (
+                f'Доставлено: {delivered_count}, в очереди: {msg.pending}'
+            )
+
+        if isinstance(msg, ConnectionStatsReceived):
+            liveness_label['text'] = format_connection_stats(msg.stats)
+
+        if tk_wakeup:
+            tk_wakeup.set()
+
+
+def format_metrics_overlay(ingest_rate: float, metrics) -> str:
+    """Строка производительности этапов клиента для панели статуса."""
+    gauges = metrics.collect_gauges()
+    queues = ', '.join(
+        f'{name[:-len("_queue_size")]} {value}'
+        for name, value in gauges.items()
+        if name.endswith('_queue_size')
+    )
+    parts = [f'Приём: {ingest_rate:.0f} сообщ./с', f'очереди: {queues}']
+    titles = {
+        'tk_frame_seconds': 'кадр Tk',
+        'send_write_seconds': 'отправка',
+        'history_write_lag_seconds': 'запись истории',
+    }
+    for name, title in titles.items():
+        summary = metrics.summaries.get(name)
+        if summary:
+            parts.append(
+                f'{title}: {summary.last * 1000:.1f} мс '
+                f'(макс. {summary.max * 1000:.1f} мс)',
+            )
+    parts.append(f'переподключений: {gauges.get("reconnect_attempts", 0)}')
+    return ' | '.join(parts)
+
+
+async def update_metrics_overlay(overlay_label, tk_wakeup, interval=1.0):
+    ingest_meter = RateMeter(metrics, 'messages_received')
+    while True:
+        await asyncio.sleep(interval)
+        overlay_label['text'] = format_metrics_overlay(
+            ingest_meter.rate(),
+            metrics,
+        )
+        tk_wakeup.set()
+
 
 def create_status_panel(root_frame):
     """Панель статуса подключения к серверу и аунтификации."""
@@ -114,10 +464,43 @@ def create_status_panel(root_frame):
     )
     status_write_label.pack(side='top', fill=tk.X)
 
-    return (nickname_label, status_read_label, status_write_label)
+    status_delivery_label = tk.Label(
+        connections_frame,
+        height=1,
+        fg='grey',
+        font='arial 10',
+        anchor='w',
+    )
+    status_delivery_label.pack(side='top', fill=tk.X)
+
+    status_liveness_label = tk.Label(
+        connections_frame,
+        height=1,
+        fg='grey',
+        font='arial 10',
+        anchor='w',
+    )
+    status_liveness_label.pack(side='top', fill=tk.X)
+
+    return (
+        nickname_label,
+        status_read_label,
+        status_write_label,
+        status_delivery_label,
+        status_liveness_label,
+    )
 
 
-async def draw(messages_queue, sending_queue, status_updates_queue):
+async def draw(
+    messages_queue,
+    sending_queue,
+    status_updates_queue,
+    display_rate: float=0,
+    history_reader=None,
+    history_page: int=200,
+    conversation_lines: int=1000,
+    metrics_overlay: bool=False,
+):
     """Отрисовка интерфейса чата."""
     root = tk.Tk()
     root.title('Чат Майнкрафтера')
@@ -127,6 +510,16 @@ async def draw(messages_queue, sending_queue, status_updates_queue):
 
     status_labels = create_status_panel(root_frame)
 
+    if metrics_overlay:
+        overlay_label = tk.Label(
+            root_frame,
+            height=1,
+            fg='grey',
+            font='arial 9',
+            anchor='w',
+        )
+        overlay_label.pack(side='bottom', fill=tk.X)
+
     input_frame = tk.Frame(root_frame)
     input_frame.pack(side='bottom', fill=tk.X)
 
@@ -149,23 +542,104 @@ async def draw(messages_queue, sending_queue, status_updates_queue):
     )
     send_button.pack(side='left')
 
+    search_queue = asyncio.Queue()
+    if history_reader:
+        search_frame = tk.Frame(root_frame)
+        search_frame.pack(side='top', fill=tk.X)
+
+        search_field = tk.Entry(search_frame)
+        search_field.pack(side='left', fill=tk.X, expand=True)
+        search_field.bind(
+            '<Return>',
+            lambda event: search_queue.put_nowait(search_field.get()),
+        )
+
+        search_button = tk.Button(search_frame)
+        search_button['text'] = 'Найти'
+        search_button['command'] = lambda: search_queue.put_nowait(
+            search_field.get(),
+        )
+        search_button.pack(side='left')
+
     conversation_panel = ScrolledText(root_frame, wrap='none')
     conversation_panel.pack(side='top', fill='both', expand=True)
 
+    conversation_view = ConversationView(
+        conversation_panel,
+        history_reader,
+        conversation_lines,
+        history_page,
+    )
+    scrolled_to_top = asyncio.Event()
+    scrolled_to_bottom = asyncio.Event()
+
+    def on_conversation_scroll(first, last):
+        conversation_panel.vbar.set(first, last)
+        if float(first) == 0:
+            scrolled_to_top.set()
+        if float(last) == 1:
+            scrolled_to_bottom.set()
+
+    conversation_panel['yscrollcommand'] = on_conversation_scroll
+
+    tk_wakeup = asyncio.Event()
+
     async with create_task_group() as tg:
         tg.start_soon(
             update_tk,
             root_frame,
+            1 / 120,
+            0.1,
+            tk_wakeup,
         )
 
         tg.start_soon(
             update_conversation_history,
-            conversation_panel,
+            conversation_view,
             messages_queue,
+            tk_wakeup,
+            display_rate,
         )
 
+        if history_reader:
+            tg.start_soon(
+                page_conversation,
+                conversation_view.load_older,
+                scrolled_to_top,
+                tk_wakeup,
+            )
+
+            tg.start_soon(
+                page_conversation,
+                conversation_view.load_newer,
+                scrolled_to_bottom,
+                tk_wakeup,
+            )
+
+            tg.start_soon(
+                catch_up_conversation,
+                conversation_view,
+                tk_wakeup,
+            )
+
+            tg.start_soon(
+                search_history,
+                root,
+                history_reader,
+                search_queue,
+                tk_wakeup,
+            )
+
         tg.start_soon(
             update_status_panel,
             status_labels,
             status_updates_queue,
+            tk_wakeup,
         )
+
+        if metrics_overlay:
+            tg.start_soon(
+                update_metrics_overlay,
+                overlay_label,
+                tk_wakeup,
+            )
@@ -0,0 +1,1088 @@
+import asyncio
+import bisect
+import datetime
+import functools
+import gzip
+import logging
+import lzma
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from pathlib import Path
+from async_timeout import timeout as async_timeout
+from message import DATE_FORMAT
+from metrics import metrics
+from utils import get_parser
+
+INDEX_SUFFIX = '.idx'
+INDEX_HEADER = struct.Struct('<Q')
+INDEX_RECORD = struct.Struct('<qQ')
+SEGMENT_NAME = re.compile(r'\.(\d{12})-(\d{12})(\.gz|\.xz)?$')
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'lzma': '.xz'}
+COMPRESSED_FILES = {'.gz': gzip.open, '.xz': lzma.open}
+# Сжатый сегмент - последовательность независимо сжатых блоков по
+# BLOCK_SIZE байт (члены gzip / потоки xz), смещения блоков в сжатом
+# файле лежат рядом в <сегмент>.blocks.
+BLOCK_SIZE = 1024 * 1024
+BLOCKS_SUFFIX = '.blocks'
+BLOCKS_HEADER = struct.Struct('<Q')
+BLOCKS_OFFSET = struct.Struct('<Q')
+BLOCK_COMPRESSORS = {'.gz': gzip.compress, '.xz': lzma.compress}
+BLOCK_DECOMPRESSORS = {'.gz': gzip.decompress, '.xz': lzma.decompress}
+COPY_SIZE = 1024 * 1024
+
+logger = logging.getLogger('history')
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_minute(date: bytes):
+    """«дд.мм.гг ЧЧ:ММ» -> epoch секунды (None, если это не дата), с кэшем."""
+    try:
+        date = datetime.datetime.strptime(date.decode(), DATE_FORMAT)
+    except ValueError:
+        return None
+    return int(date.timestamp())
+
+
+def parse_timestamp(line: bytes, previous: int=0) -> int:
+    """
+        Время сообщения из префикса «[дд.мм.гг ЧЧ:ММ]» -> epoch секунды.
+        Для строк без даты (и чтобы индекс оставался отсортированным)
+        возвращается время предыдущего сообщения. Соседние строки обычно
+        приходятся на одну минуту, поэтому разбор даты кэшируется.
+    """
+    if line[:1] != b'[' or line[15:16] != b']':
+        return previous
+    timestamp = parse_minute(line[1:15])
+    if timestamp is None:
+        return previous
+    return max(timestamp, previous)
+
+
+class Segment:
+    """
+        Закрытый сегмент истории: байты [start, end) общей истории
+        в файле <history>.<start>-<end>, сжатом, если есть suffix.
+    """
+
+    __slots__ = ('path', 'start', 'end', 'suffix')
+
+    def __init__(self, path: Path, start: int, end: int, suffix: str=''):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.suffix = suffix
+
+    @property
+    def compressed(self) -> bool:
+        return bool(self.suffix)
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+    @property
+    def blocks_path(self) -> Path:
+        return blocks_path(self.path)
+
+
+def blocks_path(path: Path) -> Path:
+    return path.with_name(f'{path.name}{BLOCKS_SUFFIX}')
+
+
+def copy_bytes(source, target, size: int) -> int:
+    """Копирование не больше <size> байт блоками -> число скопированных."""
+    copied = 0
+    while copied < size:
+        data = source.read(min(COPY_SIZE, size - copied))
+        if not data:
+            break
+        target.write(data)
+        copied += len(data)
+    return copied
+
+
+def write_durably(path: Path, write):
+    """Запись через временный файл: write(file), fsync, замена <path>."""
+    temp_path = path.with_name(f'{path.name}.tmp')
+    with open(temp_path, mode='wb') as temp_file:
+        write(temp_file)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(temp_path, path)
+
+
+class HistorySegments:
+    """
+        История как последовательность файлов: закрытые сегменты
+        <history>.<start>-<end>[.gz|.xz] и активный файл <history>,
+        в который дописываются сообщения. Смещения в индексе -
+        смещения в общей истории, они не меняются при ротации,
+        разбиении и сжатии. Из сжатых сегментов распаковываются только
+        нужные блоки, последние из них кэшируются (не больше
+        <cache_size>).
+    """
+
+    def __init__(self, filepath: str, cache_size: int=8):
+        self.filepath = Path(filepath)
+        self.cache_size = cache_size
+        self._closed = None
+        self._cache = OrderedDict()
+        self._block_tables = {}
+        self._lock = threading.Lock()
+
+    def segment_path(self, start: int, end: int, suffix: str='') -> Path:
+        return self.filepath.with_name(
+            f'{self.filepath.name}.{start:012d}-{end:012d}{suffix}',
+        )
+
+    def closed(self):
+        """
+            Закрытые сегменты по порядку. Если файлы пересекаются
+            (сегмент сжимается или разбивается), берётся исходный:
+            более длинный, а при равной длине - несжатый.
+        """
+        closed = self._closed
+        if closed is not None:
+            return closed
+
+        segments = []
+        for path in self.filepath.parent.glob(f'{self.filepath.name}.*'):
+            match = SEGMENT_NAME.fullmatch(path.name[len(self.filepath.name):])
+            if not match:
+                continue
+            start, end, suffix = match.groups()
+            segments.append(Segment(path, int(start), int(end), suffix or ''))
+        segments.sort(
+            key=lambda segment: (
+                segment.start,
+                -segment.end,
+                segment.compressed,
+            ),
+        )
+
+        closed = []
+        for segment in segments:
+            if closed and segment.start < closed[-1].end:
+                continue
+            closed.append(segment)
+        self._closed = closed
+        return closed
+
+    def refresh(self):
+        """Сброс списка сегментов после ротации или сжатия."""
+        self._closed = None
+
+    @property
+    def active_start(self) -> int:
+        closed = self.closed()
+        return closed[-1].end if closed else 0
+
+    @property
+    def end(self) -> int:
+        """Размер всей истории в байтах."""
+        active_size = 0
+        if self.filepath.is_file():
+            active_size = self.filepath.stat().st_size
+        return self.active_start + active_size
+
+    def block_table(self, segment: Segment):
+        """
+            Смещения блоков сжатого сегмента (последнее - размер файла)
+            или None, если таблицы нет или она не от этого файла.
+        """
+        try:
+            compressed_size = segment.path.stat().st_size
+            with open(segment.blocks_path, mode='rb') as blocks_file:
+                data = blocks_file.read()
+        except FileNotFoundError:
+            return None
+
+        key = (segment.path, compressed_size, len(data))
+        table = self._block_tables.get(segment.path)
+        if table is not None and table[0] == key:
+            return table[1]
+        block_size, = BLOCKS_HEADER.unpack_from(data)
+        offsets = [
+            offset for offset, in BLOCKS_OFFSET.iter_unpack(
+                data[BLOCKS_HEADER.size:],
+            )
+        ]
+        if not offsets or offsets[-1] != compressed_size:
+            return None
+        table = (block_size, offsets)
+        self._block_tables[segment.path] = (key, table)
+        return table
+
+    def _block(self, segment: Segment, offsets, number: int, segment_file):
+        """Распакованный блок <number> сжатого сегмента, с кэшем."""
+        cache_key = (segment.path, number)
+        with self._lock:
+            data = self._cache.get(cache_key)
+            if data is not None:
+                self._cache.move_to_end(cache_key)
+                return data
+
+        segment_file.seek(offsets[number])
+        compressed = segment_file.read(offsets[number + 1] - offsets[number])
+        data = BLOCK_DECOMPRESSORS[segment.suffix](compressed)
+        with self._lock:
+            self._cache[cache_key] = data
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return data
+
+    def _read_compressed(self, segment: Segment, start: int, stop: int):
+        """Байты [start, stop) сегмента без распаковки ненужных блоков."""
+        table = self.block_table(segment)
+        if table is None:
+            # Сжат одним потоком: распаковка потоком до нужного места.
+            with COMPRESSED_FILES[segment.suffix](
+                segment.path,
+                mode='rb',
+            ) as segment_file:
+                segment_file.seek(start)
+                return segment_file.read(stop - start)
+
+        block_size, offsets = table
+        first = start // block_size
+        last = (stop - 1) // block_size
+        with open(segment.path, mode='rb') as segment_file:
+            data = b''.join(
+                self._block(segment, offsets, number, segment_file)
+                for number in range(first, last + 1)
+            )
+        base = first * block_size
+        return data[start - base:stop - base]
+
+    def _read(self, start: int, stop: int) -> bytes:
+        chunks = []
+        for segment in self.closed():
+            if segment.end <= start or segment.start >= stop:
+                continue
+            local_start = max(start, segment.start) - segment.start
+            local_stop = min(stop, segment.end) - segment.start
+            if segment.compressed:
+                chunks.append(
+                    self._read_compressed(segment, local_start, local_stop),
+                )
+                continue
+            with open(segment.path, mode='rb') as segment_file:
+                segment_file.seek(local_start)
+                chunks.append(segment_file.read(local_stop - local_start))
+
+        active_start = self.active_start
+        if stop > active_start and self.filepath.is_file():
+            local_start = max(start, active_start) - active_start
+            with open(self.filepath, mode='rb') as active_file:
+                active_file.seek(local_start)
+                chunks.append(
+                    active_file.read(stop - active_start - local_start),
+                )
+        return b''.join(chunks)
+
+    def read(self, start: int, stop: int) -> bytes:
+        """Байты [<start>, <stop>) истории из любых сегментов."""
+        try:
+            data = self._read(start, stop)
+            if len(data) == stop - start:
+                return data
+        except FileNotFoundError:
+            pass
+        # Сегмент сжат или активный файл закрыт во время чтения.
+        self.refresh()
+        return self._read(start, stop)
+
+    def _compressed_buffers_from_end(self, segment: Segment):
+        """
+            Сжатый сегмент от конца к началу кусками из целых строк:
+            в памяти не больше одного-двух блоков.
+        """
+        table = self.block_table(segment)
+        if table is None:
+            # Без таблицы блоков - распаковка во временный файл.
+            with tempfile.TemporaryFile() as temp_file:
+                with COMPRESSED_FILES[segment.suffix](
+                    segment.path,
+                    mode='rb',
+                ) as segment_file:
+                    shutil.copyfileobj(segment_file, temp_file, COPY_SIZE)
+                temp_file.flush()
+                if not temp_file.tell():
+                    return
+                with mmap.mmap(
+                    temp_file.fileno(),
+                    0,
+                    access=mmap.ACCESS_READ,
+                ) as temp_map:
+                    yield temp_map
+            return
+
+        _, offsets = table
+        line_tail = b''
+        # Файл открыт до конца обхода: его замена не прервёт чтение.
+        with open(segment.path, mode='rb') as segment_file:
+            for number in reversed(range(len(offsets) - 1)):
+                data = self._block(segment, offsets, number, segment_file)
+                data += line_tail
+                if not number:
+                    yield data
+                    break
+                # Начало куска - конец строки из предыдущего блока.
+                first_line_end = data.find(b'\n') + 1
+                if not first_line_end:
+                    line_tail = data
+                    continue
+                line_tail = data[:first_line_end]
+                yield data[first_line_end:]
+
+    @contextmanager
+    def _segment_map(self, path: Path):
+        with open(path, mode='rb') as segment_file:
+            if not os.fstat(segment_file.fileno()).st_size:
+                yield b''
+                return
+            with mmap.mmap(
+                segment_file.fileno(),
+                0,
+                access=mmap.ACCESS_READ,
+            ) as segment_map:
+                yield segment_map
+
+    def _segment_buffers_from_end(self, segment: Segment):
+        if segment.compressed:
+            yield from self._compressed_buffers_from_end(segment)
+            return
+        with self._segment_map(segment.path) as buffer:
+            yield buffer
+
+    def buffers_from_end(self):
+        """
+            Содержимое истории от конца к началу кусками из целых
+            строк: активный файл, затем сегменты от новых к старым.
+        """
+        self.refresh()
+        if self.filepath.is_file():
+            with self._segment_map(self.filepath) as buffer:
+                yield buffer
+        for segment in reversed(self.closed()):
+            try:
+                yield from self._segment_buffers_from_end(segment)
+            except FileNotFoundError:
+                # Сегмент сжат или разбит до начала чтения.
+                self.refresh()
+                yield from self._replaced_buffers_from_end(segment)
+
+    def _replaced_buffers_from_end(self, segment: Segment):
+        """Сегменты, заменившие <segment>, от конца к началу."""
+        replacements = [
+            current for current in self.closed()
+            if segment.start <= current.start < segment.end
+        ]
+        for current in reversed(replacements):
+            yield from self._segment_buffers_from_end(current)
+
+    def rotate(self) -> Segment:
+        """Закрытие активного файла: он становится сегментом."""
+        start = self.active_start
+        end = self.end
+        path = self.segment_path(start, end)
+        os.replace(self.filepath, path)
+        self.refresh()
+        return Segment(path, start, end)
+
+    def _open_segment(self, segment: Segment):
+        if segment.compressed:
+            return COMPRESSED_FILES[segment.suffix](segment.path, mode='rb')
+        return open(segment.path, mode='rb')
+
+    def _remove(self, segment: Segment, keep: Path=None):
+        """Удаление файлов сегмента (кроме <keep>) после замены."""
+        kept = (keep, blocks_path(keep)) if keep else ()
+        for path in (segment.path, segment.blocks_path):
+            if path in kept:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self.refresh()
+
+    def split(self, segment: Segment, segment_size: int):
+        """
+            Разбиение большого сегмента (например, старого файла
+            истории, закрытого целиком) на сегменты примерно по
+            <segment_size> байт по границам строк -> новые сегменты.
+            Исходный файл удаляется последним: до этого closed()
+            выбирает его, так что прерванное разбиение безопасно.
+        """
+        pieces = []
+        with self._open_segment(segment) as source:
+            start = segment.start
+            while start < segment.end:
+                def write_piece(piece_file):
+                    copy_bytes(source, piece_file, segment_size)
+                    if start + piece_file.tell() < segment.end:
+                        piece_file.write(source.readline())
+
+                piece_path = self.filepath.with_name(
+                    f'{self.filepath.name}.split',
+                )
+                write_durably(piece_path, write_piece)
+                end = start + piece_path.stat().st_size
+                if end == start:
+                    break
+                path = self.segment_path(start, end)
+                os.replace(piece_path, path)
+                pieces.append(Segment(path, start, end))
+                start = end
+        self._remove(segment)
+        return pieces
+
+    def compress(self, segment: Segment, compression: str='gzip'):
+        """
+            Сжатие закрытого сегмента по блокам BLOCK_SIZE во временный
+            файл и замена им исходного сегмента (несжатого или сжатого
+            одним потоком). Таблица блоков пишется после данных: сжатый
+            файл без таблицы читается потоком. Выполняется в пуле потоков.
+        """
+        suffix = COMPRESSION_SUFFIXES[compression]
+        compress_block = BLOCK_COMPRESSORS[suffix]
+        target = self.segment_path(segment.start, segment.end, suffix)
+        offsets = []
+
+        def write_blocks(target_file):
+            with self._open_segment(segment) as source:
+                while True:
+                    block = source.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    offsets.append(target_file.tell())
+                    target_file.write(compress_block(block))
+            offsets.append(target_file.tell())
+
+        def write_table(table_file):
+            table_file.write(BLOCKS_HEADER.pack(BLOCK_SIZE))
+            table_file.write(b''.join(
+                BLOCKS_OFFSET.pack(offset) for offset in offsets
+            ))
+
+        write_durably(target, write_blocks)
+        write_durably(blocks_path(target), write_table)
+        self._remove(segment, keep=target)
+
+    def needs_archiving(
+        self,
+        segment: Segment,
+        segment_size: int,
+        compression: str,
+    ) -> bool:
+        """Сегмент надо разбить или (пере)сжать по блокам?"""
+        if segment_size and segment.size > 2 * segment_size:
+            return True
+        if not compression:
+            return False
+        return not segment.compressed or self.block_table(segment) is None
+
+    def archive(self, segment: Segment, segment_size: int, compression: str):
+        """Разбиение слишком большого сегмента и сжатие его частей."""
+        pieces = [segment]
+        if segment_size and segment.size > 2 * segment_size:
+            pieces = self.split(segment, segment_size)
+        if not compression:
+            return
+        for piece in pieces:
+            if self.needs_archiving(piece, 0, compression):
+                self.compress(piece, compression)
+
+
+class _IndexTimestamps:
+    """Последовательность меток времени индекса для bisect без загрузки."""
+
+    def __init__(self, history_index):
+        self._history_index = history_index
+
+    def __len__(self):
+        return len(self._history_index)
+
+    def __getitem__(self, seq: int) -> int:
+        return self._history_index.record(seq)[0]
+
+
+class HistoryIndex:
+    """
+        Индекс истории: номер сообщения -> (время, смещение в байтах
+        от начала всей истории, см. HistorySegments). Хранится рядом
+        с историей в файле <history>.idx: заголовок с размером
+        проиндексированной части и записи фиксированной длины.
+    """
+
+    def __init__(self, filepath: str, chunk_size: int=4 * 1024 * 1024):
+        self.filepath = Path(filepath)
+        self.segments = HistorySegments(filepath)
+        self.index_path = Path(f'{filepath}{INDEX_SUFFIX}')
+        self.chunk_size = chunk_size
+        self.indexed_end = 0
+        self.last_timestamp = 0
+        self._count = 0
+        self._lock = threading.Lock()
+        self.index_path.touch()
+        self._file = open(self.index_path, mode='r+b')
+
+        header = self._file.read(INDEX_HEADER.size)
+        if len(header) == INDEX_HEADER.size:
+            self.indexed_end, = INDEX_HEADER.unpack(header)
+            records_size = self.index_path.stat().st_size - INDEX_HEADER.size
+            self._count = records_size // INDEX_RECORD.size
+
+        # Записи, дописанные без обновления заголовка (сбой при записи).
+        while self._count and self.offset(self._count - 1) >= self.indexed_end:
+            self._count -= 1
+        self._file.truncate(self._record_position(self._count))
+        if self._count:
+            self.last_timestamp = self.record(self._count - 1)[0]
+
+    def __len__(self):
+        return self._count
+
+    @staticmethod
+    def _record_position(seq: int) -> int:
+        return INDEX_HEADER.size + seq * INDEX_RECORD.size
+
+    def record(self, seq: int):
+        """Запись индекса (время, смещение) для сообщения номер <seq>."""
+        with self._lock:
+            self._file.seek(self._record_position(seq))
+            return INDEX_RECORD.unpack(self._file.read(INDEX_RECORD.size))
+
+    def offset(self, seq: int) -> int:
+        """Смещение начала сообщения <seq> (или конец проиндексированного)."""
+        if seq >= self._count:
+            return self.indexed_end
+        return self.record(seq)[1]
+
+    def find_seq(self, timestamp: int) -> int:
+        """Номер первого сообщения не раньше <timestamp> за O(log n)."""
+        return bisect.bisect_left(_IndexTimestamps(self), timestamp)
+
+    def append(self, records, indexed_end: int):
+        """Добавление записей (время, смещение) в конец индекса."""
+        with self._lock:
+            self._file.seek(self._record_position(self._count))
+            self._file.write(b''.join(
+                INDEX_RECORD.pack(timestamp, offset)
+                for timestamp, offset in records
+            ))
+            self._file.seek(0)
+            self._file.write(INDEX_HEADER.pack(indexed_end))
+            self._file.flush()
+            self._count += len(records)
+            self.indexed_end = indexed_end
+            if records:
+                self.last_timestamp = records[-1][0]
+
+    def _reset(self):
+        with self._lock:
+            self._file.seek(0)
+            self._file.write(INDEX_HEADER.pack(0))
+            self._file.truncate(INDEX_HEADER.size)
+            self._file.flush()
+            self._count = 0
+            self.indexed_end = 0
+            self.last_timestamp = 0
+
+    def update(self):
+        """
+            Дописывание в индекс строк, появившихся в истории после
+            последней индексации (в т.ч. импорт старого файла без индекса).
+            Индекс сохраняется после каждого блока, поэтому прерванный
+            импорт продолжается с места остановки.
+        """
+        self.segments.refresh()
+        history_size = self.segments.end
+        if not history_size:
+            return
+        if self.indexed_end > history_size:
+            self._reset()
+
+        read_position = self.indexed_end
+        pending = b''
+        while self.indexed_end < history_size:
+            chunk = self.segments.read(
+                read_position,
+                min(read_position + self.chunk_size, history_size),
+            )
+            if not chunk:
+                break
+            read_position += len(chunk)
+            data = pending + chunk
+            if self.indexed_end + len(data) >= history_size:
+                complete = len(data)
+            else:
+                complete = data.rfind(b'\n') + 1
+            pending = data[complete:]
+            if not complete:
+                continue
+
+            lines = data[:complete].split(b'\n')
+            if data[complete - 1:complete] == b'\n':
+                lines.pop()
+            records = []
+            timestamp = self.last_timestamp
+            previous_prefix = None
+            offset = self.indexed_end
+            for line in lines:
+                # Время меняется раз в минуту: разбирается только новый
+                # префикс «[дата]».
+                prefix = line[:16]
+                if prefix != previous_prefix:
+                    previous_prefix = prefix
+                    timestamp = parse_timestamp(prefix, timestamp)
+                records.append((timestamp, offset))
+                offset += len(line) + 1
+            self.append(records, self.indexed_end + complete)
+
+    async def load(self):
+        """Обновление индекса в пуле потоков, не блокируя цикл событий."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.update)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class HistoryWriter:
+    """
+        Буферизованная запись истории в активный файл с дописыванием
+        индекса после каждого сброса. Активный файл закрывается
+        в сегмент, когда он больше <segment_size> байт (0 - без
+        ограничения) или (при <rotate_daily>) начались сообщения нового
+        дня; закрытые сегменты сжимаются по блокам (<compression>: gzip,
+        lzma или None) в пуле потоков, слишком большие (старый файл
+        истории) сначала разбиваются на сегменты по <segment_size>.
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        flush_size: int=64 * 1024,
+        flush_interval: float=1.0,
+        fsync_interval: float=0,
+        history_index=None,
+        segment_size: int=16 * 1024 * 1024,
+        rotate_daily: bool=False,
+        compression: str='gzip',
+    ):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.segment_size = segment_size
+        self.rotate_daily = rotate_daily
+        self.compression = compression
+        self._owns_index = history_index is None
+        if history_index is None:
+            history_index = HistoryIndex(filepath)
+        self.history_index = history_index
+        self.history_index.update()
+        self.segments = self.history_index.segments
+        self._file = open(self.segments.filepath, mode='ab')
+        self._lock = threading.Lock()
+        self._offset = self.segments.end
+        self._segment_day = self._day(self.history_index.last_timestamp)
+        self._closed_segments = [
+            segment for segment in self.segments.closed()
+            if self.segments.needs_archiving(
+                segment,
+                segment_size,
+                compression,
+            )
+        ]
+        self._buffer = []
+        self._buffer_size = 0
+        self._records = []
+        # Пачки, взятые из буфера, но ещё не записанные в файл.
+        self._pending = deque()
+        self._last_timestamp = self.history_index.last_timestamp
+        self._last_flush = time.monotonic()
+        self._last_fsync = time.monotonic()
+        self._buffered_since = None
+
+        if self._file.tell() and not self._ends_with_newline(filepath):
+            self._buffer.append(b'\n')
+            self._buffer_size += 1
+
+    @staticmethod
+    def _ends_with_newline(filepath: str) -> bool:
+        with open(Path(filepath), mode='rb') as history_file:
+            history_file.seek(-1, os.SEEK_END)
+            return history_file.read(1) == b'\n'
+
+    @staticmethod
+    def _day(timestamp: int):
+        return datetime.date.fromtimestamp(timestamp) if timestamp else None
+
+    def append(self, messages):
+        """Добавление пачки сообщений в буфер записи."""
+        if self._buffered_since is None:
+            self._buffered_since = time.monotonic()
+        for message in messages:
+            data = f'{message}\n'.encode()
+            timestamp = getattr(message, 'timestamp', None)
+            if timestamp is None:
+                self._last_timestamp = parse_timestamp(
+                    data,
+                    self._last_timestamp,
+                )
+            else:
+                # В файле время с точностью до минуты, индекс - так же.
+                self._last_timestamp = max(
+                    timestamp - timestamp % 60,
+                    self._last_timestamp,
+                )
+            self._records.append(
+                (self._last_timestamp, self._offset + self._buffer_size),
+            )
+            self._buffer.append(data)
+            self._buffer_size += len(data)
+
+    def is_flush_due(self) -> bool:
+        """Пора ли сбрасывать буфер на диск (по размеру или времени)."""
+        if not self._buffer:
+            return False
+        if self._buffer_size >= self.flush_size:
+            return True
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def _take_buffer(self):
+        data = b''.join(self._buffer)
+        records = self._records
+        self._offset += self._buffer_size
+        self._buffer = []
+        self._buffer_size = 0
+        self._records = []
+        self._last_flush = time.monotonic()
+        return data, records, self._offset
+
+    def _is_rotation_due(self, timestamp: int) -> bool:
+        active_size = self._file.tell()
+        if not active_size:
+            return False
+        if self.segment_size and active_size >= self.segment_size:
+            return True
+        return self.rotate_daily and self._day(timestamp) != self._segment_day
+
+    def _rotate(self):
+        """Закрытие активного файла в сегмент и открытие нового."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        segment = self.segments.rotate()
+        self._file = open(self.segments.filepath, mode='ab')
+        if self.segments.needs_archiving(
+            segment,
+            self.segment_size,
+            self.compression,
+        ):
+            self._closed_segments.append(segment)
+
+    def _write(self, buffer):
+        data, records, end = buffer
+        if records and self._is_rotation_due(records[0][0]):
+            self._rotate()
+        if records and not self._file.tell():
+            self._segment_day = self._day(records[0][0])
+        if data:
+            self._file.write(data)
+        if records:
+            self.history_index.append(records, end)
+
+    def _drain(self, force_fsync: bool=False):
+        """Запись по порядку всех взятых из буфера пачек (под _lock)."""
+        while self._pending:
+            self._write(self._pending.popleft())
+        self._file.flush()
+
+        now = time.monotonic()
+        fsync_due = (
+            self.fsync_interval and
+            now - self._last_fsync >= self.fsync_interval
+        )
+        if force_fsync or fsync_due:
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+
+    def _write_pending(self):
+        with self._lock:
+            if not self._file.closed:
+                self._drain()
+
+    async def flush(self):
+        """Запись буфера в файл в пуле потоков, не блокируя цикл событий."""
+        buffered_since, self._buffered_since = self._buffered_since, None
+        buffer = self._take_buffer()
+        self._pending.append(buffer)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_pending)
+        metrics.inc('history_messages_written', len(buffer[1]))
+        if buffered_since is not None:
+            metrics.observe(
+                'history_write_lag_seconds',
+                time.monotonic() - buffered_since,
+            )
+        self.compress_closed()
+
+    def compress_closed(self):
+        """
+            Фоновое разбиение слишком больших закрытых сегментов
+            (например, старого файла истории) и сжатие по блокам.
+        """
+        segments, self._closed_segments = self._closed_segments, []
+        loop = asyncio.get_running_loop()
+        for segment in segments:
+            future = loop.run_in_executor(
+                None,
+                self.segments.archive,
+                segment,
+                self.segment_size,
+                self.compression,
+            )
+            future.add_done_callback(log_compression_error)
+
+    def close(self):
+        """
+            Синхронный сброс остатка буфера и закрытие файла. Безопасен
+            при отмене задачи: дожидается записи, начатой в пуле потоков,
+            и сам записывает пачки, запись которых ещё не началась.
+        """
+        self._pending.append(self._take_buffer())
+        with self._lock:
+            self._drain(force_fsync=True)
+            self._file.close()
+        if self._owns_index:
+            self.history_index.close()
+
+
+def log_compression_error(future):
+    if not future.cancelled() and future.exception():
+        logger.error(
+            'History segment archiving failed',
+            exc_info=future.exception(),
+        )
+
+
+class HistoryReader:
+    """
+        Чтение истории по индексу: последние сообщения, постраничная
+        подгрузка более старых и выборка по времени.
+        Постраничное чтение идёт от конца истории на момент создания.
+    """
+
+    def __init__(self, filepath: str, history_index):
+        self.filepath = Path(filepath)
+        self.history_index = history_index
+        self._first_seq = len(history_index)
+
+    @property
+    def has_older(self) -> bool:
+        return self._first_seq > 0
+
+    @property
+    def first_seq(self) -> int:
+        """Номер первого сообщения, прочитанного постранично с конца."""
+        return self._first_seq
+
+    def read_range(self, start: int, stop: int):
+        """Сообщения с номерами из [<start>, <stop>)."""
+        start = max(start, 0)
+        stop = min(stop, len(self.history_index))
+        if start >= stop:
+            return []
+
+        data = self.history_index.segments.read(
+            self.history_index.offset(start),
+            self.history_index.offset(stop),
+        )
+
+        return [
+            line.decode(errors='replace').rstrip()
+            for line in data.rstrip(b'\n').split(b'\n')
+        ]
+
+    def read_last(self, count: int):
+        """Последние <count> сообщений истории."""
+        stop = len(self.history_index)
+        return self.read_range(stop - count, stop)
+
+    def read_older(self, count: int):
+        """<count> сообщений, предшествующих уже прочитанным страницам."""
+        start = max(self._first_seq - count, 0)
+        messages = self.read_range(start, self._first_seq)
+        self._first_seq = start
+        return messages
+
+    def read_between(self, since: int, until: int=None, limit: int=None):
+        """Сообщения со временем из [<since>, <until>), не больше <limit>."""
+        start = self.history_index.find_seq(since)
+        stop = len(self.history_index)
+        if until is not None:
+            stop = self.history_index.find_seq(until)
+        if limit is not None:
+            stop = min(stop, start + limit)
+        return self.read_range(start, stop)
+
+    def search(self, query: str, limit: int=500):
+        """
+            Поиск сообщений, содержащих <query> (с учётом регистра),
+            сканированием сегментов (активный - отображённым в память)
+            от конца к началу -> не больше <limit> последних совпадений
+            по порядку.
+        """
+        pattern = query.encode()
+        if not pattern:
+            return []
+
+        found = []
+        for buffer in self.history_index.segments.buffers_from_end():
+            end = len(buffer)
+            while len(found) < limit:
+                position = buffer.rfind(pattern, 0, end)
+                if position == -1:
+                    break
+                line_start = buffer.rfind(b'\n', 0, position) + 1
+                line_end = buffer.find(b'\n', position)
+                if line_end == -1:
+                    line_end = len(buffer)
+                found.append(buffer[line_start:line_end])
+                end = line_start
+            if len(found) >= limit:
+                break
+
+        return [
+            line.decode(errors='replace').rstrip()
+            for line in reversed(found)
+        ]
+
+    async def load_range(self, start: int, stop: int):
+        """Чтение сообщений [<start>, <stop>) в пуле потоков."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.read_range, start, stop)
+
+    async def find(self, query: str, limit: int=500):
+        """Поиск по истории в пуле потоков, не блокируя цикл событий."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.search, query, limit)
+
+
+def load_history(history_reader, messages_queue, count: int) -> None:
+    """Загрузка последних <count> сообщений истории в messages_queue."""
+    messages_queue.put_nowait(history_reader.read_older(count))
+
+
+async def save_messages(
+    filepath: str,
+    messages_history_queue,
+    flush_size: int=64 * 1024,
+    flush_interval: float=1.0,
+    fsync_interval: float=0,
+    history_index=None,
+    segment_size: int=16 * 1024 * 1024,
+    rotate_daily: bool=False,
+    compression: str='gzip',
+):
+    """Сохранение пачек сообщений из очереди в файл истории."""
+    history_writer = HistoryWriter(
+        filepath,
+        flush_size,
+        flush_interval,
+        fsync_interval,
+        history_index,
+        segment_size,
+        rotate_daily,
+        compression,
+    )
+    history_writer.compress_closed()
+    try:
+        while True:
+            try:
+                async with async_timeout(flush_interval) as _:
+                    history_writer.append(await messages_history_queue.get())
+            except asyncio.exceptions.TimeoutError:
+                pass
+
+            while not messages_history_queue.empty():
+                history_writer.append(messages_history_queue.get_nowait())
+
+            if history_writer.is_flush_due():
+                await history_writer.flush()
+    finally:
+        while not messages_history_queue.empty():
+            history_writer.append(messages_history_queue.get_nowait())
+        history_writer.close()
+
+
+def parse_arguments():
+    """Обработка аргументов командной строки."""
+    parser = get_parser(
+        'Query chat history by time or by last messages.',
+        'config.conf',
+    )
+    parser.add_arg(
+        '-hi',
+        '--history',
+        help='File with stored messages',
+    )
+    parser.add_arg(
+        '--since',
+        help='Show messages since this time (dd.mm.yy HH:MM)',
+    )
+    parser.add_arg(
+        '--until',
+        help='Show messages before this time (dd.mm.yy HH:MM)',
+    )
+    parser.add_arg(
+        '--last',
+        type=int,
+        default=None,
+        help='Show this many last messages (or the first ones with --since)',
+    )
+    config, _ = parser.parse_known_args()
+    return config
+
+
+def to_timestamp(date_string: str) -> int:
+    """Строка «дд.мм.гг ЧЧ:ММ» -> epoch секунды."""
+    date = datetime.datetime.strptime(date_string, DATE_FORMAT)
+    return int(date.timestamp())
+
+
+def main():
+    """Вывод сообщений истории по времени или последних сообщений."""
+    args = parse_arguments()
+    history_index = HistoryIndex(args.history)
+    history_index.update()
+    history_reader = HistoryReader(args.history, history_index)
+
+    if args.since or args.until:
+        messages = history_reader.read_between(
+            to_timestamp(args.since) if args.since else 0,
+            to_timestamp(args.until) if args.until else None,
+            args.last,
+        )
+    else:
+        messages = history_reader.read_last(args.last or 500)
+
+    for message in messages:
+        print(message)
+    history_index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import time
+
+
+class ConnectionLiveness:
+    """Время последней активности и задержки одного соединения."""
+
+    __slots__ = ('last_activity', 'max_idle', 'latency', 'events')
+
+    def __init__(self):
+        self.last_activity = time.monotonic()
+        self.max_idle = 0.0
+        self.latency = None
+        self.events = 0
+
+
+class LivenessMonitor:
+    """
+        Монотонные отметки активности соединений вместо очереди событий:
+        соединения вызывают touch() на каждое событие, а единственный
+        таймер (server.watch_for_connection) проверяет время простоя.
+    """
+
+    def __init__(self):
+        self.connections = {}
+
+    def _get(self, name: str) -> ConnectionLiveness:
+        connection = self.connections.get(name)
+        if connection is None:
+            connection = self.connections[name] = ConnectionLiveness()
+        return connection
+
+    def start(self, name: str):
+        """Новое соединение: статистика простоя начинается заново."""
+        self.connections[name] = ConnectionLiveness()
+
+    def touch(self, name: str, latency: float=None):
+        """Отметка активности; <latency> - измеренная задержка, секунды."""
+        connection = self._get(name)
+        now = time.monotonic()
+        connection.max_idle = max(
+            connection.max_idle,
+            now - connection.last_activity,
+        )
+        connection.last_activity = now
+        connection.events += 1
+        if latency is not None:
+            connection.latency = latency
+
+    def idle(self, name: str, now: float=None) -> float:
+        now = now or time.monotonic()
+        return now - self._get(name).last_activity
+
+    def stalled(self, names, timeout: float):
+        """Первое соединение из <names>, простаивающее дольше <timeout>."""
+        now = time.monotonic()
+        for name in names:
+            if self.idle(name, now) > timeout:
+                return name
+
+    def stats(self) -> dict:
+        """{соединение: {idle, max_idle, latency, events}}"""
+        now = time.monotonic()
+        return {
+            name: {
+                'idle': now - connection.last_activity,
+                'max_idle': max(
+                    connection.max_idle,
+                    now - connection.last_activity,
+                ),
+                'latency': connection.latency,
+                'events': connection.events,
+            }
+            for name, connection in self.connections.items()
+        }
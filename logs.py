@@ -0,0 +1,158 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMATS = ('json', 'text')
+TEXT_FORMAT = '%(levelname)s:%(name)s:%(message)s'
+
+
+def add_logging_arguments(parser, level: str='INFO'):
+    """Общие аргументы настройки логирования."""
+    parser.add_arg(
+        '--log_level',
+        default=level,
+        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'),
+        help='Logging level',
+    )
+    parser.add_arg(
+        '--log_format',
+        default='json',
+        choices=LOG_FORMATS,
+        help='Log records as JSON lines or plain text',
+    )
+    parser.add_arg(
+        '--log_rate',
+        type=float,
+        default=50,
+        help='Max records per second of one logger below WARNING '
+             '(0 - no limit)',
+    )
+    parser.add_arg(
+        '--log_sample',
+        type=float,
+        default=1.0,
+        help='Fraction of DEBUG records kept (1 - all)',
+    )
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+        Ограничение частоты записей ниже WARNING для каждого логгера
+        (token bucket, <rate> записей в секунду) и выборка DEBUG записей
+        с долей <sample>. Число отброшенных записей логгера добавляется
+        в следующую прошедшую фильтр запись (атрибут suppressed).
+    """
+
+    def __init__(self, rate: float=0, sample: float=1.0):
+        super().__init__()
+        self.rate = rate
+        self.sample_every = max(1, round(1 / sample)) if sample > 0 else 0
+        self._buckets = {}
+        self._debug_counts = {}
+        self._suppressed = {}
+
+    def _allow(self, record) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        if record.levelno <= logging.DEBUG:
+            if not self.sample_every:
+                return False
+            count = self._debug_counts.get(record.name, 0)
+            self._debug_counts[record.name] = count + 1
+            if count % self.sample_every:
+                return False
+
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(record.name, (self.rate, now))
+        tokens = min(self.rate, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self._buckets[record.name] = (tokens, now)
+            return False
+        self._buckets[record.name] = (tokens - 1, now)
+        return True
+
+    def filter(self, record) -> bool:
+        if not self._allow(record):
+            self._suppressed[record.name] = (
+                self._suppressed.get(record.name, 0) + 1
+            )
+            return False
+        record.suppressed = self._suppressed.pop(record.name, 0)
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+        QueueHandler, который не форматирует запись в потоке цикла
+        событий: подставляются только аргументы сообщения, а
+        форматирование и запись в поток выполняет QueueListener.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info,
+            )
+        return record
+
+
+def setup_logging(args, stream=None) -> QueueListener:
+    """
+        Логирование через очередь: вызовы логгеров только кладут запись
+        в очередь, в поток вывода пишет фоновый QueueListener.
+        Заменяет logging.basicConfig.
+    """
+    if args.log_format == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+    stream_handler = logging.StreamHandler(stream or sys.stderr)
+    stream_handler.setFormatter(formatter)
+
+    records_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(records_queue)
+    queue_handler.addFilter(RateLimitFilter(args.log_rate, args.log_sample))
+
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(args.log_level)
+
+    listener = QueueListener(records_queue, stream_handler)
+    listener.start()
+    atexit.register(stop_listener, listener)
+    return listener
+
+
+def stop_listener(listener: QueueListener):
+    """Запись оставшихся в очереди записей и остановка потока."""
+    if listener._thread:
+        listener.stop()
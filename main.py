@@ -1,22 +1,40 @@
 import asyncio
 import logging
-import aiofiles
-from pathlib import Path
 from tkinter import messagebox
 import gui
-from utils import get_parser
+from utils import (
+    get_parser,
+    reconnect_policy,
+    LONG_LINE_POLICIES,
+    MAX_LINE_LENGTH,
+)
 from server import handle_connection
+from liveness import LivenessMonitor
+from logs import add_logging_arguments, setup_logging
+from metrics import metrics, serve_metrics
+from outbox import Outbox
+from dedup import ReplayFilter, prime_from_history
+from message import MessageCounter
+from queues import (
+    DEFAULT_QUEUE_LIMITS,
+    create_queue,
+    parse_queue_limits,
+    report_dropped,
+)
+from history import (
+    HistoryIndex,
+    HistoryReader,
+    load_history,
+    save_messages,
+)
 from auntification import InvalidToken
 from anyio import create_task_group
 
 TOKEN_FILE_PATH = 'token.txt'
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger('reader')
 watchdog_logger = logging.getLogger('watchdog')
 
-logger.propagate = False
-
 
 def parse_arguments():
     """Обработка аргументов командной строки."""
@@ -44,37 +62,208 @@ def parse_arguments():
         '--history',
         help='File to store messages',
     )
+    parser.add_arg(
+        '-dr',
+        '--display_rate',
+        type=float,
+        default=0,
+        help='Max messages per second shown in chat window (0 - no limit)',
+    )
+    parser.add_arg(
+        '--history_flush_size',
+        type=int,
+        default=64 * 1024,
+        help='Flush history to disk after this many buffered bytes',
+    )
+    parser.add_arg(
+        '--history_flush_interval',
+        type=float,
+        default=1.0,
+        help='Flush buffered history at least once per this many seconds',
+    )
+    parser.add_arg(
+        '--history_fsync_interval',
+        type=float,
+        default=0,
+        help='Fsync history file at most once per this many seconds '
+             '(0 - only on exit)',
+    )
+    parser.add_arg(
+        '--history_segment_size',
+        type=int,
+        default=16 * 1024 * 1024,
+        help='Close history file into a segment after this many bytes '
+             '(0 - no size limit)',
+    )
+    parser.add_arg(
+        '--history_rotate_daily',
+        action='store_true',
+        help='Close history file into a segment when a new day starts',
+    )
+    parser.add_arg(
+        '--history_compression',
+        default='gzip',
+        choices=('gzip', 'lzma', 'none'),
+        help='Compression of closed history segments',
+    )
+    parser.add_arg(
+        '--dedup_memory',
+        type=int,
+        default=1024 * 1024,
+        help='Memory budget in bytes for hashes of recent messages used to '
+             'drop messages replayed after reconnect (0 - off)',
+    )
+    parser.add_arg(
+        '--dedup_history',
+        type=int,
+        default=1000,
+        help='Number of last history messages remembered at startup to '
+             'drop their replay',
+    )
+    parser.add_arg(
+        '--max_line_length',
+        type=int,
+        default=MAX_LINE_LENGTH,
+        help='Max length in bytes of a line read from the chat',
+    )
+    parser.add_arg(
+        '--long_lines',
+        default='truncate',
+        choices=LONG_LINE_POLICIES,
+        help='What to do with lines longer than max_line_length',
+    )
+    parser.add_arg(
+        '--history_tail',
+        type=int,
+        default=500,
+        help='Number of last history messages loaded at startup',
+    )
+    parser.add_arg(
+        '--history_page',
+        type=int,
+        default=200,
+        help='Number of history messages loaded on scroll to panel edge',
+    )
+    parser.add_arg(
+        '--conversation_lines',
+        type=int,
+        default=1000,
+        help='Max number of messages kept in chat window',
+    )
+    parser.add_arg(
+        '--reconnect_delay',
+        type=float,
+        default=0.5,
+        help='Base delay before reconnect, doubled after each failure',
+    )
+    parser.add_arg(
+        '--reconnect_max_delay',
+        type=float,
+        default=30,
+        help='Max delay before reconnect',
+    )
+    parser.add_arg(
+        '--reconnect_stable_period',
+        type=float,
+        default=10,
+        help='Seconds a connection must last to reset reconnect delay',
+    )
+    parser.add_arg(
+        '--outbox',
+        default='outbox.log',
+        help='File to keep outgoing messages until they are sent',
+    )
+    parser.add_arg(
+        '--queue_limits',
+        nargs='*',
+        default=[],
+        help='Queue bounds as NAME=SIZE[:POLICY], NAME is one of '
+             f'{", ".join(DEFAULT_QUEUE_LIMITS)}, SIZE is in messages for '
+             'messages and history (0 - no limit), POLICY is drop_oldest '
+             'or drop_newest for messages, block for history and sending, '
+             'drop_oldest, drop_newest or coalesce_latest for status',
+    )
+    parser.add_arg(
+        '--metrics_port',
+        type=int,
+        default=0,
+        help='Serve Prometheus metrics over HTTP on this port (0 - off)',
+    )
+    parser.add_arg(
+        '--metrics_host',
+        default='127.0.0.1',
+        help='Address of metrics HTTP server',
+    )
+    parser.add_arg(
+        '--metrics_overlay',
+        action='store_true',
+        help='Show performance metrics under status panel',
+    )
+    add_logging_arguments(parser, 'INFO')
     return parser.parse_args()
 
 
-async def save_messages(filepath: str, messages_history_queue):
-    """Сохранение сообщений в файл истории."""
-    while True:
-        async with aiofiles.open(Path(filepath), mode='a') as history_file:
-            history_message = await messages_history_queue.get()
-            await history_file.write(f'{history_message}\n')
-
-
-def load_history(filepath: str, messages_queue) -> None:
-    """Загрузка истории в очередь messages_queue."""
-    if Path(filepath).is_file():
-        with open(Path(filepath), mode='r') as history_file:
-            for message in history_file:
-                messages_queue.put_nowait(message.rstrip())
+def register_gauges(queues: dict, sending_queue):
+    """Длины очередей, потери и переподключения для metrics."""
+    for name, queue in queues.items():
+        metrics.add_gauge(f'{name}_queue_size', queue.size)
+        metrics.add_gauge(
+            f'{name}_queue_dropped',
+            lambda queue=queue: queue.dropped,
+        )
+    metrics.add_gauge('sending_queue_size', sending_queue.qsize)
+    metrics.add_gauge(
+        'sending_pending',
+        lambda: sending_queue.pending_count,
+    )
+    for name in ('attempts', 'failures', 'successes'):
+        metrics.add_gauge(
+            f'reconnect_{name}',
+            lambda name=name: getattr(reconnect_policy, name),
+        )
 
 
 async def run_application():
     """Функция для запуска чата."""
-    messages_queue = asyncio.Queue()
-    messages_history_queue = asyncio.Queue()
-    sending_queue = asyncio.Queue()
-    status_updates_queue = asyncio.Queue()
-    watchdog_queue = asyncio.Queue()
     args = parse_arguments()
+    setup_logging(args)
+    queue_limits = parse_queue_limits(args.queue_limits)
+    messages_queue = create_queue('messages', queue_limits)
+    messages_history_queue = create_queue('history', queue_limits)
+    status_updates_queue = create_queue('status', queue_limits)
+    liveness = LivenessMonitor()
+    reconnect_policy.configure(
+        args.reconnect_delay,
+        args.reconnect_max_delay,
+        args.reconnect_stable_period,
+    )
+    sending_queue = Outbox(
+        args.outbox,
+        maxsize=queue_limits['sending'][0],
+    )
+    history_index = HistoryIndex(args.history)
+    await history_index.load()
+    history_reader = HistoryReader(args.history, history_index)
+    message_counter = MessageCounter(len(history_index))
     load_history(
-        args.history,
+        history_reader,
         messages_queue,
+        args.history_tail,
     )
+    replay_filter = None
+    if args.dedup_memory:
+        replay_filter = ReplayFilter(args.dedup_memory)
+        prime_from_history(replay_filter, history_reader, args.dedup_history)
+        metrics.add_gauge(
+            'replayed_messages_dropped',
+            lambda: replay_filter.dropped,
+        )
+    queues = {
+        'messages': messages_queue,
+        'history': messages_history_queue,
+        'status': status_updates_queue,
+    }
+    register_gauges(queues, sending_queue)
     try:
         async with create_task_group() as tg:
             tg.start_soon(
@@ -82,6 +271,11 @@ async def run_application():
                 messages_queue,
                 sending_queue,
                 status_updates_queue,
+                args.display_rate,
+                history_reader,
+                args.history_page,
+                args.conversation_lines,
+                args.metrics_overlay,
             )
 
             tg.start_soon(
@@ -90,31 +284,52 @@ async def run_application():
                 messages_queue,
                 messages_history_queue,
                 status_updates_queue,
-                watchdog_queue,
+                liveness,
                 sending_queue,
                 logger,
                 watchdog_logger,
                 TOKEN_FILE_PATH,
+                replay_filter,
+                message_counter,
             )
 
             tg.start_soon(
                 save_messages,
                 args.history,
                 messages_history_queue,
+                args.history_flush_size,
+                args.history_flush_interval,
+                args.history_fsync_interval,
+                history_index,
+                args.history_segment_size,
+                args.history_rotate_daily,
+                None if args.history_compression == 'none' else
+                args.history_compression,
             )
 
+            tg.start_soon(report_dropped, queues, logger)
+
+            if args.metrics_port:
+                tg.start_soon(
+                    serve_metrics,
+                    args.metrics_host,
+                    args.metrics_port,
+                    logger,
+                )
+
     except InvalidToken:
         messagebox.showinfo(
             'Неверный токен',
             'Проверьте токен, сервер его не узнал.',
         )
+    finally:
+        sending_queue.close()
 
 
 def main():
     """Запуск логики приложения."""
     try:
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(run_application())
+        asyncio.run(run_application())
     except (KeyboardInterrupt, gui.TkAppClosed):
         logger.debug('Приложение закрыто.')
 
@@ -0,0 +1,68 @@
+import datetime
+import functools
+
+DATE_FORMAT = '%d.%m.%y %H:%M'
+
+
+@functools.lru_cache(maxsize=1024)
+def format_minute(minute: int) -> str:
+    """Строка даты для минуты <minute> (epoch // 60), с кэшем."""
+    return datetime.datetime.fromtimestamp(minute * 60).strftime(DATE_FORMAT)
+
+
+def line_text(line: str) -> str:
+    """Текст сообщения из строки истории «[дд.мм.гг ЧЧ:ММ] текст»."""
+    if line[:1] == '[' and line[15:17] == '] ':
+        return line[17:]
+    return line
+
+
+class Message:
+    """
+        Сообщение чата, разобранное один раз при чтении из сокета:
+        номер в истории (None, пока не пронумеровано MessageCounter),
+        время (epoch секунды), автор и текст.
+        Строка «[дата] автор: текст» собирается только при выводе.
+    """
+
+    __slots__ = ('seq', 'timestamp', 'author', 'body')
+
+    def __init__(self, seq: int, timestamp: int, author: str, body: str):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.author = author
+        self.body = body
+
+    @classmethod
+    def parse(cls, text: str, timestamp: int):
+        """Строка чата «автор: текст» -> Message без номера."""
+        author, separator, body = text.partition(': ')
+        if not separator:
+            author, body = '', text
+        return cls(None, timestamp, author, body)
+
+    @property
+    def text(self) -> str:
+        """Сообщение в том виде, в котором его прислал сервер."""
+        if not self.author:
+            return self.body
+        return f'{self.author}: {self.body}'
+
+    def __str__(self):
+        return f'[{format_minute(self.timestamp // 60)}] {self.text}'
+
+
+class MessageCounter:
+    """
+        Нумерация принятых сообщений: номер совпадает с номером строки
+        в истории, если <first_seq> - число сообщений в ней при запуске.
+    """
+
+    def __init__(self, first_seq: int=0):
+        self.next_seq = first_seq
+
+    def number(self, messages):
+        for message in messages:
+            message.seq = self.next_seq
+            self.next_seq += 1
+        return messages
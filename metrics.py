@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+PREFIX = 'minechat_'
+
+
+class Summary:
+    """Число наблюдений, их сумма, максимум и последнее значение."""
+
+    __slots__ = ('count', 'sum', 'max', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.last = value
+
+
+class Metrics:
+    """
+        Счётчики, значения и сводки времени работы этапов клиента.
+        Значения, которые дорого обновлять на каждом событии
+        (длины очередей), читаются функциями из add_gauge при снятии.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.summaries = {}
+        self.gauges = {}
+
+    def inc(self, name: str, value: float=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        summary = self.summaries.get(name)
+        if summary is None:
+            summary = self.summaries[name] = Summary()
+        summary.observe(value)
+
+    def add_gauge(self, name: str, getter):
+        """<getter>() -> текущее значение, вызывается при снятии метрик."""
+        self.gauges[name] = getter
+
+    def collect_gauges(self) -> dict:
+        return {name: getter() for name, getter in self.gauges.items()}
+
+    def render_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus."""
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'# TYPE {PREFIX}{name}_total counter')
+            lines.append(f'{PREFIX}{name}_total {value}')
+        for name, value in sorted(self.collect_gauges().items()):
+            lines.append(f'# TYPE {PREFIX}{name} gauge')
+            lines.append(f'{PREFIX}{name} {value}')
+        for name, summary in sorted(self.summaries.items()):
+            lines.append(f'# TYPE {PREFIX}{name} summary')
+            lines.append(f'{PREFIX}{name}_count {summary.count}')
+            lines.append(f'{PREFIX}{name}_sum {summary.sum}')
+            # В summary допустимы только _count, _sum и квантили.
+            lines.append(f'# TYPE {PREFIX}{name}_max gauge')
+            lines.append(f'{PREFIX}{name}_max {summary.max}')
+            lines.append(f'# TYPE {PREFIX}{name}_last gauge')
+            lines.append(f'{PREFIX}{name}_last {summary.last}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class RateMeter:
+    """Скорость роста счётчика между двумя вызовами rate()."""
+
+    def __init__(self, metrics: Metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+        self._value = metrics.counters.get(name, 0)
+        self._measured_at = time.monotonic()
+
+    def rate(self) -> float:
+        value = self.metrics.counters.get(self.name, 0)
+        now = time.monotonic()
+        elapsed = now - self._measured_at
+        rate = (value - self._value) / elapsed if elapsed else 0.0
+        self._value, self._measured_at = value, now
+        return rate
+
+
+async def handle_metrics_request(reader, writer, metrics: Metrics=metrics):
+    """Ответ на любой HTTP запрос текстом метрик."""
+    try:
+        while (await reader.readline()).strip():
+            pass
+        body = metrics.render_prometheus().encode()
+        writer.write(
+            b'HTTP/1.1 200 OK\r\n'
+            b'Content-Type: text/plain; version=0.0.4\r\n'
+            b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+            b'Connection: close\r\n\r\n' + body,
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(host: str, port: int, logger):
+    """Локальный HTTP сервер метрик (формат Prometheus) до отмены."""
+    server = await asyncio.start_server(handle_metrics_request, host, port)
+    logger.info(f'Metrics are served on http://{host}:{port}/metrics')
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+from pathlib import Path
+
+
+class Outbox:
+    """
+        Очередь исходящих сообщений с журналом на диске.
+        Каждое сообщение получает локальный номер и записывается в журнал
+        («M», номер, текст) до постановки в очередь; после доставки в
+        сокет записывается подтверждение («A», номер). Неподтверждённые
+        сообщения переживают разрывы соединения и перезапуски
+        и отправляются повторно по порядку номеров.
+        Если неподтверждённых сообщений <maxsize> (0 - без ограничения),
+        put_nowait() вызывает asyncio.QueueFull, а put() ждёт доставки.
+    """
+
+    def __init__(
+        self,
+        filepath: str=None,
+        compact_threshold: int=1000,
+        fsync: bool=False,
+        maxsize: int=0,
+    ):
+        self.filepath = Path(filepath) if filepath else None
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        self.maxsize = maxsize
+        self._acked = asyncio.Event()
+        self._pending = {}
+        self._queue = asyncio.Queue()
+        self._next_seq = 0
+        self._log_records = 0
+        self._file = None
+        if self.filepath:
+            self._replay_log()
+            self._file = open(self.filepath, mode='a', encoding='utf-8')
+        for seq in self._pending:
+            self._queue.put_nowait(seq)
+
+    @staticmethod
+    def _parse_record(line: bytes):
+        """Строка журнала -> (вид, номер, текст); ValueError для обрывка."""
+        if not line.endswith(b'\n'):
+            raise ValueError('Torn outbox record')
+        kind, seq, *payload = line.decode().rstrip('\n').split('\t', 2)
+        if kind == 'M' and payload:
+            return kind, int(seq), json.loads(payload[0])
+        if kind == 'A' and not payload:
+            return kind, int(seq), None
+        raise ValueError(f'Unknown outbox record: {line!r}')
+
+    def _replay_log(self):
+        """
+            Восстановление неподтверждённых сообщений из журнала.
+            Оборванная или испорченная запись (сбой во время записи)
+            и всё после неё отрезаются, чтобы новые записи не
+            дописывались к обрывку.
+        """
+        if not self.filepath.is_file():
+            return
+        valid_size = 0
+        with open(self.filepath, mode='rb') as log_file:
+            for line in log_file:
+                try:
+                    kind, seq, message = self._parse_record(line)
+                except ValueError:
+                    break
+                valid_size += len(line)
+                self._next_seq = max(self._next_seq, seq + 1)
+                self._log_records += 1
+                if kind == 'M':
+                    self._pending[seq] = message
+                else:
+                    self._pending.pop(seq, None)
+        if valid_size < self.filepath.stat().st_size:
+            os.truncate(self.filepath, valid_size)
+        self._pending = dict(sorted(self._pending.items()))
+
+    def _write_log(self, lines):
+        if not self._file:
+            return
+        self._file.write(''.join(lines))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._log_records += len(lines)
+
+    def put_nowait(self, message: str):
+        """Запись сообщения в журнал и постановка в очередь отправки."""
+        if self.full():
+            raise asyncio.QueueFull
+        seq = self._next_seq
+        self._next_seq += 1
+        self._write_log([f'M\t{seq}\t{json.dumps(message)}\n'])
+        self._pending[seq] = message
+        self._queue.put_nowait(seq)
+
+    async def put(self, message: str):
+        while self.full():
+            self._acked.clear()
+            await self._acked.wait()
+        self.put_nowait(message)
+
+    async def get(self):
+        """Следующее неподтверждённое сообщение -> (номер, текст)."""
+        while True:
+            seq = await self._queue.get()
+            if seq in self._pending:
+                return seq, self._pending[seq]
+
+    def get_nowait(self):
+        while True:
+            seq = self._queue.get_nowait()
+            if seq in self._pending:
+                return seq, self._pending[seq]
+
+    def empty(self) -> bool:
+        return self._queue.empty()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self._pending)
+
+    @property
+    def pending_count(self) -> int:
+        """Число сообщений, доставка которых ещё не подтверждена."""
+        return len(self._pending)
+
+    def ack(self, seqs):
+        """Подтверждение доставки; повторные подтверждения игнорируются."""
+        seqs = [seq for seq in seqs if seq in self._pending]
+        for seq in seqs:
+            del self._pending[seq]
+        self._write_log([f'A\t{seq}\n' for seq in seqs])
+        if seqs:
+            self._acked.set()
+        garbage_records = self._log_records - len(self._pending)
+        if garbage_records >= self.compact_threshold:
+            self.compact()
+
+    def requeue_unacked(self):
+        """
+            Повторная постановка в очередь всех неподтверждённых
+            сообщений по порядку (после нового подключения).
+        """
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        for seq in self._pending:
+            self._queue.put_nowait(seq)
+
+    def compact(self):
+        """Перезапись журнала: остаются только неподтверждённые."""
+        if not self._file:
+            return
+        self._file.close()
+        temp_path = self.filepath.with_name(f'{self.filepath.name}.tmp')
+        with open(temp_path, mode='w', encoding='utf-8') as temp_file:
+            temp_file.write(''.join(
+                f'M\t{seq}\t{json.dumps(message)}\n'
+                for seq, message in self._pending.items()
+            ))
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, self.filepath)
+        self._file = open(self.filepath, mode='a', encoding='utf-8')
+        self._log_records = len(self._pending)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,187 @@
+import asyncio
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+COALESCE_LATEST = 'coalesce_latest'
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, COALESCE_LATEST)
+
+# Размеры messages и history - в сообщениях, остальных - в элементах.
+DEFAULT_QUEUE_LIMITS = {
+    'messages': (5000, DROP_OLDEST),
+    'history': (20000, BLOCK),
+    'status': (100, COALESCE_LATEST),
+    'sending': (10000, BLOCK),
+}
+
+# Политики, допустимые для очередей чата. По номерам сообщений в
+# history строится индекс истории, поэтому она не теряет пачки.
+# Вывод (messages) не должен задерживать чтение и запись истории:
+# пропущенные сообщения панель подгружает из истории. status
+# наполняется только через put_nowait и ждать места не может.
+QUEUE_POLICIES = {
+    'messages': (DROP_OLDEST, DROP_NEWEST),
+    'history': (BLOCK,),
+    'status': (DROP_OLDEST, DROP_NEWEST, COALESCE_LATEST),
+    'sending': (BLOCK,),
+}
+
+# Элементы messages и history - пачки (списки) сообщений.
+QUEUE_WEIGHTS = {
+    'messages': len,
+    'history': len,
+}
+
+
+def status_key(item):
+    """Ключ объединения статусов: тип статуса (а для Enum - его класс)."""
+    return type(item)
+
+
+class BoundedQueue(asyncio.Queue):
+    """
+        Очередь с ограничением размера и политикой переполнения:
+        block - put() ждёт места, put_nowait() вызывает QueueFull;
+        drop_oldest - вытесняется самый старый элемент;
+        drop_newest - новый элемент отбрасывается;
+        coalesce_latest - элемент того же вида (<key>) заменяется новым
+        (или объединяется с ним, если у элемента есть метод merge).
+        Если задан <weight>, размер считается не в элементах, а в сумме
+        weight(элемент) (например, в сообщениях для пачек). Политики
+        потерь освобождают место под весь новый элемент, а не
+        помещающийся и в пустую очередь принимают целиком; block ждёт,
+        пока вес не станет меньше maxsize, и может превысить его на
+        один элемент.
+        Число потерянных элементов (их вес) хранится в dropped.
+    """
+
+    def __init__(
+        self,
+        maxsize: int=0,
+        policy: str=BLOCK,
+        key=status_key,
+        weight=None,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown queue policy: {policy}')
+        super().__init__(maxsize)
+        self.policy = policy
+        self.key = key
+        self.weight = weight
+        self.dropped = 0
+        self._size = 0
+
+    def _weight(self, item) -> int:
+        return self.weight(item) if self.weight else 1
+
+    def _put(self, item):
+        super()._put(item)
+        self._size += self._weight(item)
+
+    def _get(self):
+        item = super()._get()
+        self._size -= self._weight(item)
+        return item
+
+    def size(self) -> int:
+        """Заполненность очереди: число элементов или их вес."""
+        return self._size
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self._size
+
+    def _fits(self, item) -> bool:
+        return (
+            not self.maxsize or
+            self._size + self._weight(item) <= self.maxsize
+        )
+
+    def _remove(self, item):
+        self._queue.remove(item)
+        self._size -= self._weight(item)
+        self.task_done()
+
+    def _discard(self, item):
+        self._remove(item)
+        self.dropped += self._weight(item)
+
+    def put_nowait(self, item):
+        if self.policy == COALESCE_LATEST:
+            item_key = self.key(item)
+            for queued_item in list(self._queue):
+                if self.key(queued_item) != item_key:
+                    continue
+                if hasattr(queued_item, 'merge'):
+                    item = queued_item.merge(item)
+                    self._remove(queued_item)
+                else:
+                    self._discard(queued_item)
+
+        if self.policy != BLOCK and not self._fits(item):
+            if self.policy == DROP_NEWEST and self._queue:
+                self.dropped += self._weight(item)
+                return
+            while self._queue and not self._fits(item):
+                self._discard(self._queue[0])
+
+        super().put_nowait(item)
+
+    async def put(self, item):
+        """Ожидание места только для политики block."""
+        if self.policy == BLOCK:
+            await super().put(item)
+        else:
+            self.put_nowait(item)
+
+
+def check_queue_policy(name: str, policy: str):
+    if policy not in QUEUE_POLICIES[name]:
+        raise ValueError(
+            f'Queue {name} policy must be one of: '
+            f'{", ".join(QUEUE_POLICIES[name])}',
+        )
+
+
+def parse_queue_limits(specs) -> dict:
+    """
+        Разбор «name=size[:policy]» (например, messages=500:drop_oldest)
+        поверх DEFAULT_QUEUE_LIMITS.
+    """
+    limits = dict(DEFAULT_QUEUE_LIMITS)
+    for spec in specs or []:
+        name, _, value = spec.partition('=')
+        size, _, policy = value.partition(':')
+        if name not in limits:
+            raise ValueError(f'Unknown queue: {name}')
+        policy = policy or limits[name][1]
+        check_queue_policy(name, policy)
+        limits[name] = (int(size), policy)
+    return limits
+
+
+def create_queue(name: str, limits: dict=None):
+    maxsize, policy = (limits or DEFAULT_QUEUE_LIMITS)[name]
+    check_queue_policy(name, policy)
+    return BoundedQueue(maxsize, policy, weight=QUEUE_WEIGHTS.get(name))
+
+
+def get_dropped_counts(queues: dict) -> dict:
+    return {
+        name: getattr(queue, 'dropped', 0)
+        for name, queue in queues.items()
+    }
+
+
+async def report_dropped(queues: dict, logger, interval: float=5):
+    """Предупреждение в лог, если очереди теряют элементы."""
+    previous = get_dropped_counts(queues)
+    while True:
+        await asyncio.sleep(interval)
+        current = get_dropped_counts(queues)
+        for name, dropped in current.items():
+            if dropped > previous[name]:
+                logger.warning(
+                    f'Queue {name} overflow: dropped '
+                    f'{dropped - previous[name]} items ({dropped} total)',
+                )
+        previous = current
@@ -5,16 +5,22 @@ from tkinter import messagebox
 from anyio import create_task_group
 from async_timeout import timeout as async_timeout
 from gui import update_tk
+from logs import add_logging_arguments, setup_logging
+from queues import (
+    BoundedQueue,
+    COALESCE_LATEST,
+    DROP_NEWEST,
+    DROP_OLDEST,
+)
 from utils import get_parser
 from auntification import register, UserStateReceived, RegisterReceived
 
-register_response_queue = asyncio.Queue()
-register_request_queue = asyncio.Queue()
-status_updates_queue = asyncio.Queue()
+register_response_queue = BoundedQueue(100, DROP_OLDEST)
+register_request_queue = BoundedQueue(100, DROP_NEWEST)
+status_updates_queue = BoundedQueue(10, COALESCE_LATEST)
 
 TOKEN_FILE_NAME = 'token.txt'
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger('register')
 
 
@@ -34,6 +40,13 @@ def parse_arguments():
         '--write_port',
         help='Server PORT to write messages',
     )
+    parser.add_arg(
+        '--register_timeout',
+        type=float,
+        default=3,
+        help='Seconds to wait for registration',
+    )
+    add_logging_arguments(parser, 'INFO')
     config, _ = parser.parse_known_args()
     return config
 
@@ -46,6 +59,7 @@ async def register_from_queue(
     register_response_queue,
     status_updates_queue,
     logger,
+    register_timeout: float=3,
 ):
     """
         Регистрации пользователя
@@ -54,7 +68,7 @@ async def register_from_queue(
     while True:
         username = await register_request_queue.get()
         try:
-            async with async_timeout(3) as _:
+            async with async_timeout(register_timeout) as _:
                 await register(
                     host,
                     port,
@@ -106,7 +120,7 @@ def process_new_register(input_field, register_request_queue):
     register_request_queue.put_nowait(text)
 
 
-async def update_status_panel(status_labels, status_updates_queue):
+async def update_status_panel(status_labels, status_updates_queue, tk_wakeup):
     nickname_label, token_lable = status_labels
 
     nickname_label['text'] = 'Ник: не определено'
@@ -116,6 +130,7 @@ async def update_status_panel(status_labels, status_updates_queue):
         status_message = await status_updates_queue.get()
         nickname_label['text'] = f'Ник: {status_message.nickname}'
         token_lable['text'] = f'Токен: {status_message.status}'
+        tk_wakeup.set()
 
 
 async def update_alerts(register_response_queue):
@@ -172,17 +187,22 @@ async def draw(
             register_request_queue,
     )
     status_labels = create_status_panel(root_frame)
+    tk_wakeup = asyncio.Event()
 
     async with create_task_group() as tg:
         tg.start_soon(
             update_tk,
             root_frame,
+            1 / 120,
+            0.1,
+            tk_wakeup,
         )
 
         tg.start_soon(
             update_status_panel,
             status_labels,
             status_updates_queue,
+            tk_wakeup,
         )
 
         tg.start_soon(
@@ -193,6 +213,7 @@ async def draw(
 
 async def main():
     args = parse_arguments()
+    setup_logging(args)
     async with create_task_group() as tg:
         tg.start_soon(
             draw,
@@ -210,6 +231,7 @@ async def main():
             register_response_queue,
             status_updates_queue,
             logger,
+            args.register_timeout,
         )
 
 
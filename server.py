@@ -1,146 +1,212 @@
 import asyncio
-import datetime
 import time
-import gui
+import states
 from async_timeout import timeout as async_timeout
 from anyio import create_task_group
 from auntification import authorize
+from message import Message
+from metrics import metrics
 from utils import (
     reconnect,
     open_connection,
-    read_and_print_from_socket,
+    LineFramer,
+    MAX_LINE_LENGTH,
     change_timeout_to_connection_error,
     write_to_socket,
 )
 
 
-@change_timeout_to_connection_error
-async def ping_server(
-    watchdog_queue,
-    host: str,
-    port: str,
+async def watch_for_connection(
+    liveness,
+    status_queue,
     logger,
-    timeout: float=0.3,
-    interval: float=0.3,
+    timeout: float=1.5,
+    check_interval: float=0.1,
+    report_interval: float=1.0,
+    watched=('send',),
 ):
     """
-        Отправка пустого сообщения раз в <interval>
-        секунд и запись в watchdog_queue. В случае превышения <timeout>
-        вызывается ConnectionError.
+        Проверка раз в <check_interval> секунд, что соединения <watched>
+        были активны не позже, чем <timeout> секунд назад (иначе -
+        ConnectionError). Раз в <report_interval> секунд статистика
+        простоя и задержек соединений отправляется в status_queue.
     """
-    async with open_connection(host, port, logger) as (_, writer):
-        while True:
-            async with async_timeout(timeout) as _:
-                if writer.is_closing():
-                    await writer.wait_closed()
-                    raise ConnectionError
+    for name in watched:
+        liveness.start(name)
+    reported_at = time.monotonic()
+    while True:
+        await asyncio.sleep(check_interval)
+        stalled = liveness.stalled(watched, timeout)
+        if stalled:
+            logger.warning(
+                f'Connection {stalled} is idle for '
+                f'{liveness.idle(stalled):.2f} s, reconnecting',
+            )
+            raise ConnectionError(f'Connection {stalled} stalled')
 
-                await submit_message(
-                    writer,
-                    '',
-                    logger,
-                )
-                watchdog_queue.put_nowait('Message sent')
-            await asyncio.sleep(interval)
+        now = time.monotonic()
+        if now - reported_at >= report_interval:
+            status_queue.put_nowait(
+                states.ConnectionStatsReceived(liveness.stats()),
+            )
+            reported_at = now
 
 
-@change_timeout_to_connection_error
-async def watch_for_connection(watchdog_queue, logger, timeout: float=1.5):
-    """
-        Опрос очереди watchdog_queue и
-        ожидание сообщения минимум раз в <timeout>.
-    """
-    while True:
-        async with async_timeout(timeout) as _:
-            message = await watchdog_queue.get()
-            logger.debug(f'[{time.time()}] Connection is alive. {message}')
+def format_message(message: str) -> str:
+    """Сообщение чата в формате протокола (конец - пустая строка)."""
+    return '{}\n\n'.format(message.replace("\n", "\\n"))
 
 
-async def submit_message(writer, message: str, logger):
-    """Отправка сообщения в чат."""
+async def submit_messages(writer, messages, logger):
+    """Отправка пачки сообщений в чат одной записью и одним drain."""
     await write_to_socket(
         writer,
-        '{}\n\n'.format(message.replace("\n", "\\n")),
+        ''.join(map(format_message, messages)),
         logger,
     )
 
 
+@change_timeout_to_connection_error
 async def send_msgs(
     sending_queue,
     status_queue,
-    watchdog_queue,
+    liveness,
     host: str,
     port: str,
     logger,
     token_file_path: str,
+    ping_interval: float=0.3,
+    ping_timeout: float=0.3,
+    max_batch: int=100,
 ):
     """
-        Отправка сообщений из очереди sending_queue в чат.
+        Отправка сообщений из sending_queue (outbox.Outbox) в чат. Всё,
+        что накопилось в очереди (до <max_batch> сообщений), отправляется
+        одной записью; доставка в сокет подтверждается в sending_queue
+        и сообщается в status_queue, а время записи отмечается
+        в liveness как задержка соединения «send». После каждой авторизации
+        неподтверждённые сообщения отправляются заново.
+        Если за <ping_interval> секунд сообщений не было, в то же
+        соединение отправляется пустое сообщение. Отправка пустого
+        сообщения дольше <ping_timeout> вызывает ConnectionError.
     """
     while True:
-        status_queue.put_nowait(gui.NicknameReceived('Неизвестно'))
-        status_queue.put_nowait(gui.SendingConnectionStateChanged.INITIATED)
+        status_queue.put_nowait(states.NicknameReceived('Неизвестно'))
+        status_queue.put_nowait(states.SendingConnectionStateChanged.INITIATED)
+        liveness.start('send')
         async with open_connection(host, port, logger) as (reader, writer):
+            lines = LineFramer(reader, logger)
             status_queue.put_nowait(
-                gui.SendingConnectionStateChanged.ESTABLISHED,
+                states.SendingConnectionStateChanged.ESTABLISHED,
             )
-            watchdog_queue.put_nowait('Prompt before auth')
+            liveness.touch('send')
+            auth_started_at = time.monotonic()
             username = await authorize(
-                reader,
+                lines,
                 writer,
                 logger,
                 token_file_path,
             )
-            watchdog_queue.put_nowait('Authorization done')
-            status_queue.put_nowait(gui.NicknameReceived(username))
+            liveness.touch('send', time.monotonic() - auth_started_at)
+            status_queue.put_nowait(states.NicknameReceived(username))
             status_queue.put_nowait(
-                gui.SendingConnectionStateChanged.ESTABLISHED,
+                states.SendingConnectionStateChanged.ESTABLISHED,
             )
+            sending_queue.requeue_unacked()
             while True:
                 if writer.is_closing():
                     await writer.wait_closed()
                     break
 
-                message = await sending_queue.get()
-                await submit_message(
-                    writer,
-                    message,
-                    logger,
-                )
-                watchdog_queue.put_nowait('Message sent')
-        status_queue.put_nowait(gui.SendingConnectionStateChanged.CLOSED)
+                try:
+                    async with async_timeout(ping_interval) as _:
+                        messages = [await sending_queue.get()]
+                except asyncio.exceptions.TimeoutError:
+                    messages = []
+
+                while len(messages) < max_batch and not sending_queue.empty():
+                    messages.append(sending_queue.get_nowait())
+
+                write_started_at = time.monotonic()
+                async with async_timeout(
+                    None if messages else ping_timeout,
+                ) as _:
+                    await submit_messages(
+                        writer,
+                        [message for _, message in messages] or [''],
+                        logger,
+                    )
+
+                if messages:
+                    metrics.inc('messages_sent', len(messages))
+                    sending_queue.ack([seq for seq, _ in messages])
+                    status_queue.put_nowait(states.MessagesDelivered(
+                        [message for _, message in messages],
+                        sending_queue.qsize(),
+                    ))
+                write_time = time.monotonic() - write_started_at
+                liveness.touch('send', write_time)
+                metrics.observe('send_write_seconds', write_time)
+        status_queue.put_nowait(states.SendingConnectionStateChanged.CLOSED)
 
 
 async def read_msgs(
     messages_queue,
     messages_history_queue,
     status_queue,
-    watchdog_queue,
+    liveness,
     host: str,
     port: str,
     logger,
+    replay_filter=None,
+    max_line_length: int=MAX_LINE_LENGTH,
+    long_lines: str='truncate',
+    message_counter=None,
 ):
     """
-        Чтение сообщения из чата и наполнение очередей
-        messages_queue и messages_history_queue.
+        Чтение сообщений из чата пачками и наполнение очередей
+        messages_queue и messages_history_queue общими списками
+        message.Message. Повторно присланные после подключения
+        сообщения отсеиваются <replay_filter> (dedup.ReplayFilter),
+        оставшиеся нумеруются <message_counter> (message.MessageCounter).
+        Если очередь с политикой block заполнена, чтение из сокета
+        приостанавливается до её разгрузки; очередь вывода
+        messages_queue чтение не задерживает. Строки длиннее
+        <max_line_length> байт обрезаются или пропускаются
+        (<long_lines>, см. utils.LineFramer).
     """
     while True:
-        status_queue.put_nowait(gui.ReadConnectionStateChanged.INITIATED)
+        status_queue.put_nowait(states.ReadConnectionStateChanged.INITIATED)
+        liveness.start('read')
         async with open_connection(host, port, logger) as (reader, _):
-            status_queue.put_nowait(gui.ReadConnectionStateChanged.ESTABLISHED)
-            while not reader.at_eof():
-                text_from_chat = await read_and_print_from_socket(
-                    reader,
-                    logger,
-                )
-                date_string = datetime.datetime.now().strftime('%d.%m.%y %H:%M')  # noqa: E501
-                message = f'[{date_string}] {text_from_chat}'
-                messages_history_queue.put_nowait(message)
-                messages_queue.put_nowait(message)
-                watchdog_queue.put_nowait('New message in chat')
-                await asyncio.sleep(1)
-
-        status_queue.put_nowait(gui.ReadConnectionStateChanged.CLOSED)
+            status_queue.put_nowait(
+                states.ReadConnectionStateChanged.ESTABLISHED,
+            )
+            if replay_filter is not None:
+                replay_filter.start_connection()
+            lines = LineFramer(reader, logger, max_line_length, long_lines)
+            while not lines.at_eof():
+                texts_from_chat = await lines.read_batch()
+                liveness.touch('read')
+                if not texts_from_chat:
+                    continue
+                metrics.inc('messages_received', len(texts_from_chat))
+
+                timestamp = int(time.time())
+                messages = [
+                    Message.parse(text_from_chat, timestamp)
+                    for text_from_chat in texts_from_chat
+                ]
+                if replay_filter is not None:
+                    messages = replay_filter.filter(messages)
+                    if not messages:
+                        continue
+                if message_counter is not None:
+                    message_counter.number(messages)
+                await messages_history_queue.put(messages)
+                messages_queue.put_nowait(messages)
+
+        status_queue.put_nowait(states.ReadConnectionStateChanged.CLOSED)
 
 
 @reconnect
@@ -149,38 +215,36 @@ async def handle_connection(
     messages_queue,
     messages_history_queue,
     status_updates_queue,
-    watchdog_queue,
+    liveness,
     sending_queue,
     logger,
     watchdog_logger,
     token_file_path: str,
-):  # noqa: E501
+    replay_filter=None,
+    message_counter=None,
+):
     """Группа задач для работы с сервером."""
     async with create_task_group() as tg:
-        tg.start_soon(
-            ping_server,
-            watchdog_queue,
-            args.host,
-            args.write_port,
-            watchdog_logger,
-        )
-
         tg.start_soon(
             read_msgs,
             messages_queue,
             messages_history_queue,
             status_updates_queue,
-            watchdog_queue,
+            liveness,
             args.host,
             args.read_port,
             logger,
+            replay_filter,
+            args.max_line_length,
+            args.long_lines,
+            message_counter,
         )
 
         tg.start_soon(
             send_msgs,
             sending_queue,
             status_updates_queue,
-            watchdog_queue,
+            liveness,
             args.host,
             args.write_port,
             logger,
@@ -189,6 +253,7 @@ async def handle_connection(
 
         tg.start_soon(
             watch_for_connection,
-            watchdog_queue,
+            liveness,
+            status_updates_queue,
             watchdog_logger,
         )
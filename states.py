@@ -0,0 +1,46 @@
+from enum import Enum
+
+
+class ReadConnectionStateChanged(Enum):
+    INITIATED = 'устанавливаем соединение'
+    ESTABLISHED = 'соединение установлено'
+    CLOSED = 'соединение закрыто'
+
+    def __str__(self):
+        return str(self.value)
+
+
+class SendingConnectionStateChanged(Enum):
+    INITIATED = 'устанавливаем соединение'
+    ESTABLISHED = 'соединение установлено'
+    CLOSED = 'соединение закрыто'
+
+    def __str__(self):
+        return str(self.value)
+
+
+class NicknameReceived:
+    def __init__(self, nickname):
+        self.nickname = nickname
+
+
+class MessagesDelivered:
+    """Сообщения записаны в сокет; <pending> ещё ждут в очереди."""
+
+    def __init__(self, messages, pending: int):
+        self.messages = messages
+        self.pending = pending
+
+    def merge(self, other):
+        """Объединение двух отчётов о доставке в очереди статусов."""
+        return MessagesDelivered(self.messages + other.messages, other.pending)
+
+
+class ConnectionStatsReceived:
+    """
+        Статистика соединений из liveness.LivenessMonitor.stats():
+        {соединение: {idle, max_idle, latency, events}}.
+    """
+
+    def __init__(self, stats: dict):
+        self.stats = stats
@@ -0,0 +1,74 @@
+import gzip
+import pytest
+import history
+from history import HistoryIndex, HistoryReader, HistorySegments
+
+
+def write_lines(path, numbers):
+    lines = [
+        f'[01.02.24 10:{number % 60:02d}] bot: message {number}'
+        for number in numbers
+    ]
+    with open(path, mode='ab') as history_file:
+        history_file.write(''.join(f'{line}\n' for line in lines).encode())
+    return lines
+
+
+def open_reader(path):
+    history_index = HistoryIndex(str(path))
+    history_index.update()
+    return HistoryReader(str(path), history_index)
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(history, 'BLOCK_SIZE', 256)
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'lzma'])
+def test_rotate_split_compress_read_across_segments(tmp_path, compression):
+    path = tmp_path / 'chat.history'
+    lines = write_lines(path, range(300))
+    segments = HistorySegments(str(path))
+    segments.archive(segments.rotate(), 2000, compression)
+    lines += write_lines(path, range(300, 320))
+
+    closed = segments.closed()
+    assert len(closed) > 2
+    assert all(segment.compressed for segment in closed)
+    assert all(segments.block_table(segment) for segment in closed)
+
+    reader = open_reader(path)
+    assert reader.read_range(0, len(lines)) == lines
+    assert reader.read_range(100, 150) == lines[100:150]
+    assert reader.read_last(5) == lines[-5:]
+    assert reader.search('message 1', limit=1000) == [
+        line for line in lines if 'message 1' in line
+    ]
+    assert reader.search('message 2', limit=3) == [
+        line for line in lines if 'message 2' in line
+    ][-3:]
+
+
+def test_single_stream_segment_is_read_and_converted(tmp_path):
+    path = tmp_path / 'chat.history'
+    lines = write_lines(path, range(100))
+    segments = HistorySegments(str(path))
+    segment = segments.rotate()
+    compressed_path = segments.segment_path(segment.start, segment.end, '.gz')
+    compressed_path.write_bytes(gzip.compress(segment.path.read_bytes()))
+    segment.path.unlink()
+    segments.refresh()
+
+    legacy, = segments.closed()
+    assert segments.block_table(legacy) is None
+    reader = open_reader(path)
+    assert reader.read_last(10) == lines[-10:]
+    assert reader.search('message 5', limit=100) == [
+        line for line in lines if 'message 5' in line
+    ]
+
+    segments.archive(legacy, 0, 'gzip')
+    converted, = segments.closed()
+    assert segments.block_table(converted)
+    assert open_reader(path).read_range(0, len(lines)) == lines
@@ -0,0 +1,27 @@
+from outbox import Outbox
+
+
+def test_torn_tail_is_truncated_before_new_records(tmp_path):
+    log_path = tmp_path / 'outbox.log'
+    log_path.write_text('M\t0\t"sent"\nA\t0\nM\t1\t"half-writ')
+
+    outbox = Outbox(str(log_path))
+    outbox.put_nowait('next')
+    outbox.close()
+
+    assert log_path.read_text().endswith('A\t0\nM\t1\t"next"\n')
+    restored = Outbox(str(log_path))
+    assert restored.get_nowait() == (1, 'next')
+    assert restored.pending_count == 1
+    restored.close()
+
+
+def test_corrupt_record_ends_replay(tmp_path):
+    log_path = tmp_path / 'outbox.log'
+    log_path.write_text('M\t0\t"kept"\nM\t1\t"broken\nM\t2\t"lost"\n')
+
+    outbox = Outbox(str(log_path))
+    outbox.close()
+
+    assert outbox.pending_count == 1
+    assert log_path.read_text() == 'M\t0\t"kept"\n'
@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+from queues import (
+    BLOCK,
+    DROP_NEWEST,
+    DROP_OLDEST,
+    BoundedQueue,
+    create_queue,
+    parse_queue_limits,
+)
+
+
+def batches(queue):
+    return [batch[0] for batch in queue._queue]
+
+
+def test_drop_oldest_makes_room_for_whole_batch():
+    queue = BoundedQueue(10, DROP_OLDEST, weight=len)
+    for number in range(5):
+        queue.put_nowait([number] * 3)
+
+    assert batches(queue) == [2, 3, 4]
+    assert (queue.size(), queue.dropped) == (9, 6)
+
+    queue.put_nowait([9] * 30)
+    assert batches(queue) == [9]
+    assert (queue.size(), queue.dropped) == (30, 15)
+
+
+def test_drop_newest_and_block_count_messages():
+    queue = BoundedQueue(10, DROP_NEWEST, weight=len)
+    for number in range(5):
+        queue.put_nowait([number] * 3)
+    assert batches(queue) == [0, 1, 2]
+    assert queue.dropped == 6
+
+    queue = BoundedQueue(10, BLOCK, weight=len)
+    queue.put_nowait([0] * 50)
+    with pytest.raises(asyncio.QueueFull):
+        queue.put_nowait([1])
+    queue.get_nowait()
+    assert queue.size() == 0 and not queue.full()
+
+
+def test_display_queue_cannot_block():
+    assert create_queue('messages').policy == DROP_OLDEST
+    with pytest.raises(ValueError):
+        parse_queue_limits(['messages=10:block'])
+    with pytest.raises(ValueError):
+        create_queue('messages', {'messages': (10, BLOCK)})
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from utils import LineFramer
+
+logger = logging.getLogger('test')
+
+
+def feed(data: bytes):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+async def read_all_batches(lines):
+    batches = []
+    while not lines.at_eof():
+        batches.extend(await asyncio.wait_for(lines.read_batch(), 1))
+    return batches
+
+
+def test_read_batch_returns_partial_trailing_line_at_eof():
+    async def run():
+        lines = LineFramer(feed(b'bot: hello\nbot: cut-off'), logger)
+        return await read_all_batches(lines)
+
+    assert asyncio.run(run()) == ['bot: hello', 'bot: cut-off']
+
+
+def test_read_line_returns_partial_trailing_line_at_eof():
+    async def run():
+        lines = LineFramer(feed(b'a\nb'), logger)
+        return [await lines.read_line() for _ in range(3)]
+
+    assert asyncio.run(run()) == ['a', 'b', '']
+
+
+def test_split_utf8_sequence_is_joined():
+    async def run():
+        reader = asyncio.StreamReader()
+        data = 'привет\n'.encode()
+        for position in range(len(data)):
+            reader.feed_data(data[position:position + 1])
+        reader.feed_eof()
+        return await read_all_batches(LineFramer(reader, logger))
+
+    assert asyncio.run(run()) == ['привет']
+
+
+def test_long_lines_are_truncated_or_skipped():
+    data = b'ok\n' + b'x' * 50 + b'\nend\n'
+
+    async def run(long_lines):
+        lines = LineFramer(feed(data), logger, 20, long_lines, chunk_size=7)
+        return await read_all_batches(lines)
+
+    assert asyncio.run(run('truncate')) == ['ok', 'x' * 20, 'end']
+    assert asyncio.run(run('skip')) == ['ok', 'end']
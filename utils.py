@@ -1,11 +1,16 @@
 import json
+import logging
 from anyio import ExceptionGroup
 import asyncio
 import decorator
+import random
+import time
 from pathlib import Path
 from socket import gaierror
 import configargparse
+from collections import deque
 from contextlib import asynccontextmanager
+from metrics import metrics
 
 
 @decorator.decorator
@@ -20,23 +25,118 @@ async def change_timeout_to_connection_error(task, *args, **kwargs):
         raise ConnectionError
 
 
+class ReconnectPolicy:
+    """
+        Экспоненциальная задержка между переподключениями со случайным
+        разбросом (full jitter) и счётчики попыток переподключения.
+        Соединение, продержавшееся <stable_period> секунд, считается
+        восстановленным: счёт неудач и задержка сбрасываются.
+    """
+
+    def __init__(
+        self,
+        base_delay: float=0.5,
+        max_delay: float=30,
+        stable_period: float=10,
+    ):
+        self.configure(base_delay, max_delay, stable_period)
+        self.attempts = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_reconnect_time = 0.0
+        self.total_reconnect_time = 0.0
+        self._outage_started = None
+        self._attempt_started = None
+
+    def configure(
+        self,
+        base_delay: float,
+        max_delay: float,
+        stable_period: float,
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stable_period = stable_period
+
+    def next_delay(self) -> float:
+        """Задержка перед следующей попыткой: U(0, min(cap, base * 2^n))."""
+        exponent = min(self.consecutive_failures - 1, 32)
+        return random.uniform(
+            0,
+            min(self.max_delay, self.base_delay * 2 ** exponent),
+        )
+
+    def on_attempt(self):
+        self.attempts += 1
+        self._attempt_started = time.monotonic()
+        return asyncio.get_running_loop().call_later(
+            self.stable_period,
+            self.on_stable,
+        )
+
+    def on_stable(self):
+        """Соединение продержалось <stable_period> секунд."""
+        self.successes += 1
+        self.consecutive_failures = 0
+        if self._outage_started is not None:
+            self.last_reconnect_time = (
+                self._attempt_started - self._outage_started
+            )
+            self.total_reconnect_time += self.last_reconnect_time
+            self._outage_started = None
+
+    def on_failure(self) -> float:
+        """Учёт разрыва соединения -> задержка перед новой попыткой."""
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self._outage_started is None:
+            self._outage_started = time.monotonic()
+        return self.next_delay()
+
+    def as_dict(self) -> dict:
+        return {
+            'attempts': self.attempts,
+            'successes': self.successes,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+            'last_reconnect_time': self.last_reconnect_time,
+            'total_reconnect_time': self.total_reconnect_time,
+        }
+
+
+reconnect_policy = ReconnectPolicy()
+
+
+def is_connection_error(ex) -> bool:
+    """ConnectionError, gaierror или группа только из таких ошибок."""
+    if isinstance(ex, ExceptionGroup):
+        return all(is_connection_error(ex) for ex in ex.exceptions)
+    return isinstance(ex, (ConnectionError, gaierror))
+
+
 @decorator.decorator
-async def reconnect(task, *args, **kwargs):
+async def reconnect(task, policy=None, *args, **kwargs):
     """
-        Перезапуск карутины в случае ConnectionError и gaierror.
+        Перезапуск карутины в случае ConnectionError и gaierror
+        с задержками по политике <policy> (по умолчанию reconnect_policy).
     """
+    policy = policy or reconnect_policy
     while True:
+        stable_handle = policy.on_attempt()
         try:
             result = await task(*args, **kwargs)
             return result
         except (ConnectionError, gaierror):
-            await asyncio.sleep(0.5)
+            pass
         except ExceptionGroup as ex_group:
             for ex in ex_group.exceptions:
-                if not isinstance(ex, (ConnectionError, gaierror)):
+                if not is_connection_error(ex):
                     raise ex
+        finally:
+            stable_handle.cancel()
 
-        await asyncio.sleep(0.5)
+        await asyncio.sleep(policy.on_failure())
 
 
 def convert_json_string_to_object(json_string: str):
@@ -57,11 +157,156 @@ async def write_to_socket(writer, message: str, logger):
     await writer.drain()
 
 
-async def read_and_print_from_socket(reader, logger):
-    """Чтения и вывод строки из сокета."""
-    string_from_chat = (await reader.readline()).decode().rstrip()
-    logger.debug(string_from_chat)
-    return string_from_chat
+MAX_LINE_LENGTH = 64 * 1024
+LONG_LINE_POLICIES = ('truncate', 'skip')
+
+
+def utf8_boundary(data, position: int) -> int:
+    """Ближайшая к <position> слева граница символа UTF-8 в <data>."""
+    while position > 0 and data[position] & 0xC0 == 0x80:
+        position -= 1
+    return position
+
+
+class LineFramer:
+    """
+        Разбиение потока из reader на строки в одном переиспользуемом
+        bytearray. Декодируются только полные строки, сразу всей пачкой;
+        неполная строка (в т.ч. с оборванным символом UTF-8) ждёт
+        следующих данных, неверные байты заменяются.
+        Строка длиннее <max_line_length> обрезается (long_lines=truncate)
+        или пропускается (skip) вместо ошибки StreamReader.
+    """
+
+    def __init__(
+        self,
+        reader,
+        logger,
+        max_line_length: int=MAX_LINE_LENGTH,
+        long_lines: str='truncate',
+        chunk_size: int=2 ** 16,
+    ):
+        if long_lines not in LONG_LINE_POLICIES:
+            raise ValueError(f'Unknown long lines policy: {long_lines}')
+        self.reader = reader
+        self.logger = logger
+        self.max_line_length = max_line_length
+        self.long_lines = long_lines
+        self.chunk_size = chunk_size
+        self.truncated = 0
+        self.skipped = 0
+        self._buffer = bytearray()
+        self._lines = deque()
+        self._discarding = False
+
+    def at_eof(self) -> bool:
+        return not self._lines and not self._buffer and self.reader.at_eof()
+
+    async def _fill(self) -> bool:
+        """Чтение следующего блока в буфер -> False в конце потока."""
+        chunk = await self.reader.read(self.chunk_size)
+        if not chunk:
+            return False
+
+        if self._discarding:
+            line_end = chunk.find(b'\n')
+            if line_end == -1:
+                return True
+            chunk = memoryview(chunk)[line_end + 1:]
+            self._discarding = False
+        self._buffer += chunk
+        return True
+
+    def _cut_long_line(self):
+        """Неполная строка превысила лимит: обрезка или пропуск."""
+        if self.long_lines == 'truncate':
+            cut = utf8_boundary(self._buffer, self.max_line_length)
+            self._lines.append(
+                self._buffer[:cut].decode(errors='replace').rstrip(),
+            )
+            self.truncated += 1
+            metrics.inc('lines_truncated')
+        else:
+            self.skipped += 1
+            metrics.inc('lines_skipped')
+        self.logger.warning(
+            f'Line longer than {self.max_line_length} bytes: '
+            f'{self.long_lines}',
+        )
+        self._buffer.clear()
+        self._discarding = True
+
+    def _limit_lines(self, lines):
+        limited = []
+        short_line = self.max_line_length // 4
+        for line in lines:
+            if len(line) <= short_line:
+                limited.append(line)
+                continue
+            encoded = line.encode()
+            if len(encoded) <= self.max_line_length:
+                limited.append(line)
+            elif self.long_lines == 'truncate':
+                cut = utf8_boundary(encoded, self.max_line_length)
+                limited.append(encoded[:cut].decode())
+                self.truncated += 1
+                metrics.inc('lines_truncated')
+            else:
+                self.skipped += 1
+                metrics.inc('lines_skipped')
+        return limited
+
+    def _split_lines(self):
+        """Полные строки из буфера -> очередь строк."""
+        complete = self._buffer.rfind(b'\n') + 1
+        if not complete:
+            if len(self._buffer) > self.max_line_length:
+                self._cut_long_line()
+            return
+
+        text = memoryview(self._buffer)[:complete].tobytes().decode(
+            errors='replace',
+        )
+        del self._buffer[:complete]
+        lines = [line.rstrip() for line in text[:-1].split('\n')]
+        if complete > self.max_line_length:
+            lines = self._limit_lines(lines)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            for line in lines:
+                self.logger.debug(line)
+        self._lines.extend(lines)
+        if len(self._buffer) > self.max_line_length:
+            self._cut_long_line()
+
+    def _take_tail(self):
+        """Конец потока: неполная последняя строка - как обычная строка."""
+        if self._buffer:
+            self._lines.append(self._buffer.decode(errors='replace').rstrip())
+            self._buffer.clear()
+        self._discarding = False
+
+    async def read_batch(self):
+        """
+            Все полные строки, доступные после одного чтения из сокета.
+            В конце потока возвращается и неполная последняя строка.
+        """
+        if not self._lines:
+            if await self._fill():
+                self._split_lines()
+            else:
+                self._take_tail()
+        lines = list(self._lines)
+        self._lines.clear()
+        return lines
+
+    async def read_line(self) -> str:
+        """Следующая строка ('' в конце потока), как reader.readline()."""
+        while not self._lines:
+            if not await self._fill():
+                self._take_tail()
+                return self._lines.popleft() if self._lines else ''
+            self._split_lines()
+        return self._lines.popleft()
 
 
 async def close_connection(writer, logger):